@@ -0,0 +1,697 @@
+#!/usr/bin/env python3
+
+#===============================================================================
+# Benchmarks of `psv-*.py` scripts.
+#
+# `--startup` runs `<script> -h` for every `psv-*.py` entry point in a fresh
+# Python process and reports its wall time, which shows how long a script
+# takes before it does any real work (imports, login, dataset listing, etc).
+#
+# `--importtime` runs the same command with `python -X importtime`, and
+# checks the time of its imports against a budget, and that it doesn't
+# import any of the heavy modules that scripts only import when needed.
+#
+# `--api` runs typical commands of `psv-tree.py`, `psv-compare.py`,
+# `psv-sync.py` and `psv-meta.py` against a fake Pennsieve server (see
+# `psv_fake.py`), and checks the number of API calls and wall time of each
+# command against its budget.
+#
+# `--micro` runs the helpers that are called once per file (path building,
+# file name resolution, exclusion and comparison) on 10^4 to 10^6 synthetic
+# entries, and compares their throughput with a saved baseline.
+#===============================================================================
+
+import glob
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from psv_lib import parse_options
+
+SYNTAX = """
+psv-bench.py -h (help)
+             --startup (time `<script> -h` of every psv-*.py script)
+             --importtime (time imports of `<script> -h` of every script)
+             --api (run scripts against a fake Pennsieve server)
+             --micro (benchmark helpers that are called once per file)
+             -n <runs> (default: 5)
+             -b <budget> (max median startup time in milliseconds, default: 500)
+             -i <budget> (max median import time in milliseconds, default: 100)
+             -t <threshold> (max throughput regression of `--micro` in
+                             percent, default: 20)
+             --baseline <file> (baseline of `--micro`, default:
+                                ~/.pennsieve/psv_bench_baseline.json)
+             --save-baseline (save results of `--micro` as the baseline)
+
+Note:
+  * The exit status is 1 if any script fails or exceeds the budget, or any
+    helper is slower than the baseline by more than the threshold.
+  * Fake server of `--api` can be changed by `PSV_FAKE` environment variable
+    (see `psv_fake.py`).
+"""
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that must not be imported by `<script> -h` (`--importtime`),
+# because they are only needed by some code paths
+DEFERRED_MODULES = ['pandas', 'pennsieve', 'requests', 'termcolor', 'aiohttp']
+
+# Fake server of `--api` benchmarks, unless PSV_FAKE is set
+FAKE_SETTINGS = "donors=3,categories=18,subdirs=2,packages=10,latency=0.002"
+
+# API calls of each step of a scenario (see API_SCENARIOS)
+CATALOG_CALLS = 2      # catalog (every scenario starts with an empty cache)
+DATASET_CALLS = 1      # a dataset, which is looked up by name
+COLLECTION_CALLS = 1   # items of a collection (or of the dataset itself)
+PACKAGE_CALLS = 1      # sources of a package whose source file is needed
+DOWNLOAD_CALLS = 2     # presigned URL of a source file, and the file
+PROPERTIES_CALLS = 1   # properties of a dataset, collection or package
+
+
+def crawl_calls(c):
+    """Return API calls to crawl a dataset of `c` collections."""
+
+    return DATASET_CALLS + c * COLLECTION_CALLS
+
+
+# Scenarios of `--api` option: name, command line ('{out}' is replaced by
+# an output directory that is shared by all scenarios), and its intended
+# API calls as a tuple of (calls sent one by one, calls sent concurrently),
+# which is a function of the shape of fake datasets (see
+# `get_fake_shape()`): `c` (number of collections in a dataset, including
+# the dataset itself), `p` (number of packages in a dataset) and `d`
+# (number of datasets).  Collections are listed one by one, because a
+# collection is only listed after its parent; packages are resolved
+# concurrently; downloads are sent one by one by `psv-sync.py --jobs 1`.
+# The call budget of a scenario is the sum of both.
+API_SCENARIOS = [
+    (
+        'tree',
+        ['psv-tree.py', '-d', 'HPAP-001', '--data', '--nocolor'],
+        lambda c, p, d: (CATALOG_CALLS + crawl_calls(c), p * PACKAGE_CALLS),
+    ),
+    (
+        'tree-all',
+        ['psv-tree.py', '--all', '--nocolor'],
+        lambda c, p, d: (CATALOG_CALLS + d * crawl_calls(c), 0),
+    ),
+    (
+        'compare',
+        ['psv-compare.py', '-d', 'HPAP-001', '-c', 'HPAP-002', '--data'],
+        lambda c, p, d: (
+            CATALOG_CALLS + 2 * crawl_calls(c), 2 * p * PACKAGE_CALLS
+        ),
+    ),
+    (
+        'sync',
+        ['psv-sync.py', '-d', 'HPAP-001', '-o', '{out}'],
+        lambda c, p, d: (
+            CATALOG_CALLS + crawl_calls(c) + p * DOWNLOAD_CALLS,
+            p * PACKAGE_CALLS
+        ),
+    ),
+    (
+        # Files are unchanged since 'sync', so none is downloaded
+        'sync-quick',
+        ['psv-sync.py', '-q', '-d', 'HPAP-001', '-o', '{out}'],
+        lambda c, p, d: (CATALOG_CALLS + crawl_calls(c), p * PACKAGE_CALLS),
+    ),
+    (
+        # Only the top-level collections are listed to find 'Histology'
+        'meta',
+        ['psv-meta.py', '-d', 'HPAP-001', '-p', 'Histology', '--show'],
+        lambda c, p, d: (
+            CATALOG_CALLS + DATASET_CALLS + COLLECTION_CALLS
+            + PROPERTIES_CALLS, 0
+        ),
+    ),
+]
+
+# Wall time budget of a scenario: this many seconds for startup and local
+# work, plus the time of its API calls, in which concurrent calls are sent
+# API_CONCURRENCY at a time (the initial window of `AdaptiveLimiter`)
+API_TIME_OVERHEAD = 1.5
+API_CONCURRENCY = 4
+
+# Numbers of entries of `--micro` benchmarks; a benchmark is not run on
+# more entries once a run takes longer than MICRO_TIME_LIMIT seconds.
+MICRO_SIZES = [10 ** 4, 10 ** 5, 10 ** 6]
+MICRO_TIME_LIMIT = 2.0
+
+# Number of local files that `check_package()` is benchmarked on (all
+# entries share them, so that millions of files are not created), and
+# their size in bytes
+MICRO_FILES = 10 ** 4
+MICRO_FILE_SIZE = 16
+
+# Temporary directory of MICRO_FILES files, created by `get_micro_files()`
+_micro_dir = None
+
+# Baseline of `--micro` benchmarks
+MICRO_BASELINE = os.path.expanduser('~/.pennsieve/psv_bench_baseline.json')
+
+
+def get_entry_points():
+    """Return all `psv-*.py` scripts except this one (all of them accept `-h`)."""
+
+    return [
+        path for path in sorted(glob.glob(f"{SCRIPT_DIR}/psv-*.py"))
+        if path != os.path.abspath(__file__)
+    ]
+
+
+def time_startup(script, runs):
+    """
+    Return a tuple of (median_time_in_ms, return_code) of running
+    `<script> -h` in a fresh Python process `runs` times.
+    """
+
+    times = list()
+    ret_code = 0
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, script, '-h'],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        times.append((time.perf_counter() - start_time) * 1000)
+        ret_code = ret_code or proc.returncode
+
+    return statistics.median(times), ret_code
+
+
+def bench_startup(runs, budget):
+    """Benchmark startup time of all entry points; return number of failures."""
+
+    print(f"{'script':<20} {'median (ms)':>12}  status")
+    print('-' * 42)
+
+    failures = 0
+    for script in get_entry_points():
+        median, ret_code = time_startup(script, runs)
+        if ret_code != 0:
+            status = f"FAILED (exit {ret_code})"
+        elif median > budget:
+            status = f"OVER BUDGET ({budget} ms)"
+        else:
+            status = "ok"
+
+        if status != "ok":
+            failures += 1
+
+        print(f"{os.path.basename(script):<20} {median:>12.1f}  {status}")
+
+    return failures
+
+
+def time_imports(script, runs):
+    """
+    Run `<script> -h` with `python -X importtime` `runs` times, and return
+    a tuple of (median_import_time_in_ms, top_level_imports, return_code),
+    in which `top_level_imports` is a dict of the cumulative time (in ms)
+    of each top-level module that the script imports (in the last run).
+    """
+
+    times = list()
+    ret_code = 0
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', script, '-h'],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        ret_code = ret_code or proc.returncode
+
+        # Lines look like "import time: <self_us> | <cumulative_us> | <name>",
+        # in which names of nested imports are indented.
+        imports = dict()
+        for line in proc.stderr.splitlines():
+            fields = line.split('|')
+            if not line.startswith('import time:') or len(fields) != 3:
+                continue
+
+            name = fields[2][1:]
+            if name.startswith(' ') or not fields[1].strip().isdigit():
+                continue
+
+            imports[name] = int(fields[1]) / 1000
+
+        times.append(sum(imports.values()))
+
+    return statistics.median(times), imports, ret_code
+
+
+def bench_imports(runs, budget):
+    """Benchmark import time of all entry points; return number of failures."""
+
+    print(f"{'script':<20} {'imports (ms)':>12}  {'heaviest import':<28} status")
+    print('-' * 76)
+
+    failures = 0
+    for script in get_entry_points():
+        median, imports, ret_code = time_imports(script, runs)
+        heavy = [x for x in DEFERRED_MODULES if x in imports]
+        if ret_code != 0:
+            status = f"FAILED (exit {ret_code})"
+        elif heavy:
+            status = f"IMPORTS {', '.join(heavy)}"
+        elif median > budget:
+            status = f"OVER BUDGET ({budget} ms)"
+        else:
+            status = "ok"
+
+        if status != "ok":
+            failures += 1
+
+        heaviest = max(imports, key=imports.get, default='-')
+        heaviest_str = f"{heaviest} ({imports.get(heaviest, 0):.1f} ms)"
+        print(
+            f"{os.path.basename(script):<20} {median:>12.1f}  "
+            f"{heaviest_str:<28} {status}"
+        )
+
+    return failures
+
+
+def run_api_scenario(name, args, tmp_dir, fake_spec):
+    """
+    Run the script of an API scenario against fake server `fake_spec`,
+    and return a tuple of (call_counts, seconds, return_code).
+    """
+
+    stats_file = f"{tmp_dir}/{name}.json"
+    env = dict(
+        os.environ,
+        PSV_FAKE=fake_spec,
+        PSV_FAKE_STATS=stats_file,
+        PSV_CATALOG_FILE=f"{tmp_dir}/{name}-catalog.json",
+        PSV_INDEX_FILE=f"{tmp_dir}/index.db",
+        PSV_DAEMON='0',
+    )
+    args = [x.replace('{out}', f"{tmp_dir}/out") for x in args]
+
+    start_time = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, f"{SCRIPT_DIR}/{args[0]}"] + args[1:],
+        cwd=tmp_dir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    seconds = time.perf_counter() - start_time
+
+    try:
+        with open(stats_file) as fd:
+            calls = json.load(fd)['calls']
+    except (OSError, ValueError, KeyError):
+        calls = dict()
+
+    return calls, seconds, proc.returncode
+
+
+def get_fake_shape(settings):
+    """
+    Return a tuple of (collections, packages, datasets) of a fake server of
+    `settings` (see API_SCENARIOS), which is walked without latency.
+    Collections and packages are those of its first dataset (all datasets
+    are alike), including the dataset itself.
+    """
+
+    from psv_fake import FakeClient
+
+    client = FakeClient(**dict(settings, latency=0))
+    datasets = client.datasets()
+
+    collections, packages = 0, 0
+    pending = [min(datasets, key=lambda x: x.name)]
+    while pending:
+        collections += 1
+        for item in pending.pop().items:
+            if item.type == 'Collection':
+                pending.append(item)
+            else:
+                packages += 1
+
+    return collections, packages, len(datasets)
+
+
+def bench_api():
+    """Run all API scenarios against a fake server; return number of failures."""
+
+    from psv_fake import parse_settings
+
+    fake_spec = os.environ.get('PSV_FAKE', FAKE_SETTINGS)
+    settings = parse_settings(fake_spec)
+    c, p, d = get_fake_shape(settings)
+
+    print(f"Fake server: {fake_spec}")
+    print(f"({c} collections and {p} packages in each of {d} datasets)\n")
+    print(
+        f"{'scenario':<12} {'calls':>7} {'budget':>7} {'seconds':>8} "
+        f"{'budget':>7}  status"
+    )
+    print('-' * 56)
+
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix='psv-bench-') as tmp_dir:
+        for name, args, budget in API_SCENARIOS:
+            calls, seconds, ret_code = run_api_scenario(
+                name, args, tmp_dir, fake_spec
+            )
+            serial, concurrent = budget(c, p, d)
+            max_calls = serial + concurrent
+            max_seconds = API_TIME_OVERHEAD + settings['latency'] * (
+                serial + concurrent / API_CONCURRENCY
+            )
+            n_calls = sum(calls.values())
+
+            if ret_code != 0:
+                status = f"FAILED (exit {ret_code})"
+            elif n_calls > max_calls:
+                status = "OVER CALL BUDGET"
+            elif seconds > max_seconds:
+                status = "OVER TIME BUDGET"
+            else:
+                status = "ok"
+
+            if status != "ok":
+                failures += 1
+
+            print(
+                f"{name:<12} {n_calls:>7} {max_calls:>7} {seconds:>8.2f} "
+                f"{max_seconds:>7.2f}  {status}"
+            )
+            if status != "ok":
+                print(f"    calls: {json.dumps(calls, sort_keys=True)}")
+
+    return failures
+
+
+def load_script(name):
+    """Return script `name` as a module (without running its main program)."""
+
+    module_name = name.replace('-', '_').replace('.py', '')
+    spec = importlib.util.spec_from_file_location(
+        module_name, f"{SCRIPT_DIR}/{name}"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def get_synthetic_names(n):
+    """Return a list of `n` pairs of (package_name, real_name)."""
+
+    extensions = ['fastq.gz', 'ome.tiff', 'bigWig', 'bw', 'csv', 'txt', 'tar']
+    names = list()
+    for i in range(n):
+        ext = extensions[i % len(extensions)]
+        pkg_name = f"HPAP-{i % 200:03d}_sample_{i}"
+        if i % 3 == 0:
+            pkg_name += f".{ext}"
+
+        names.append((pkg_name, f"{pkg_name.split('.')[0]}.{ext}"))
+
+    return names
+
+
+def get_synthetic_collections(n):
+    """
+    Return a list of `n` tuples of (depth, name, package_id) of a
+    depth-first crawl: categories of 10 samples, each of which has 10
+    packages (package_id is None for collections).
+    """
+
+    entries = list()
+    while len(entries) < n:
+        c = len(entries)
+        entries.append((0, f"Category {c}", None))
+        for s in range(10):
+            entries.append((1, f"Sample {s}", None))
+            for p in range(10):
+                entries.append(
+                    (2, f"file_{c}_{s}_{p}.fastq.gz", f"N:package:{c}-{s}-{p}")
+                )
+
+    return entries[:n]
+
+
+def get_synthetic_paths(n, prefix):
+    """Return a list of `n` dataset paths, half of which start with `prefix`."""
+
+    return [
+        f"{prefix if i % 2 else 'Shared'}/Sample {i % 100}/file_{i}.fastq.gz"
+        for i in range(n)
+    ]
+
+
+def setup_path_nodes(n):
+    from psv_lib import PathNode, add_path_node
+
+    entries = get_synthetic_collections(n)
+
+    def run():
+        parents = [PathNode(None, '/tmp/out/HPAP-001')]
+        nodes = [add_path_node(parents, *x) for x in entries]
+        return [x.path for x in nodes]
+
+    return run
+
+
+def setup_get_file_name(n):
+    from psv_lib import get_file_name
+
+    names = get_synthetic_names(n)
+
+    def run():
+        # Time the names themselves, not the cache of previous runs
+        get_file_name.cache_clear()
+        return [get_file_name(x, y) for x, y in names]
+
+    return run
+
+
+def setup_remove_extension(n):
+    sync = load_script('psv-sync.py')
+    names = [x for x, _ in get_synthetic_names(n)]
+    remove_extension = sync.remove_extension
+    return lambda: [remove_extension(x) for x in names]
+
+
+def setup_excluded(n):
+    sync = load_script('psv-sync.py')
+    sync.EXCLUDED_PATHS = [f"Category {i}/Sample 0" for i in range(100)]
+    names = [x for x, _ in get_synthetic_names(n)]
+    excluded = sync.excluded
+    return lambda: [excluded(x) for x in names]
+
+
+def get_micro_files():
+    """
+    Return a list of paths of MICRO_FILES local files of MICRO_FILE_SIZE
+    bytes, which are created in a temporary directory the first time (and
+    removed at exit).
+    """
+
+    global _micro_dir
+
+    if _micro_dir is None:
+        _micro_dir = tempfile.TemporaryDirectory(prefix='psv-bench-')
+        for i in range(MICRO_FILES):
+            with open(f"{_micro_dir.name}/file_{i}", 'wb') as fd:
+                fd.write(b'x' * MICRO_FILE_SIZE)
+
+    return [f"{_micro_dir.name}/file_{i}" for i in range(MICRO_FILES)]
+
+
+def setup_check_package(n):
+    from psv_lib import PackageInfo
+
+    sync = load_script('psv-sync.py')
+    names = get_synthetic_names(n)
+    files = get_micro_files()
+
+    # Every file exists, has the same size as its package, and is newer
+    # than it, so the whole check is run (and says it's unchanged)
+    updated_at = '2020-01-01T00:00:00.000Z'
+    packages = [
+        (
+            PackageInfo(x, x, y, MICRO_FILE_SIZE, None, updated_at),
+            files[i % MICRO_FILES]
+        )
+        for i, (x, y) in enumerate(names)
+    ]
+    check_package = sync.check_package
+    return lambda: [check_package(x, y) for x, y in packages]
+
+
+def setup_find_first_only(n):
+    compare = load_script('psv-compare.py')
+    paths_1 = get_synthetic_paths(n, 'Left')
+    paths_2 = get_synthetic_paths(n, 'Right')
+    find_first_only = compare.find_first_only
+
+    def run():
+        with open(os.devnull, 'w') as fd, redirect_stdout(fd):
+            find_first_only(paths_1, paths_2, True)
+
+    return run
+
+
+# Benchmarks of `--micro` option: name and a function that sets up the
+# benchmark on `n` entries and returns the function to be timed
+MICRO_BENCHMARKS = [
+    ('path_nodes', setup_path_nodes),
+    ('get_file_name', setup_get_file_name),
+    ('remove_extension', setup_remove_extension),
+    ('excluded', setup_excluded),
+    ('check_package', setup_check_package),
+    ('find_first_only', setup_find_first_only),
+]
+
+
+def time_micro(setup, n, runs):
+    """Return the best time (in seconds) of `runs` runs on `n` entries."""
+
+    func = setup(n)
+    times = list()
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start_time)
+
+        # Don't repeat a run that is too slow
+        if times[-1] > MICRO_TIME_LIMIT:
+            break
+
+    return min(times)
+
+
+def read_baseline(filename):
+    """Return the baseline in `filename` (empty if it doesn't exist)."""
+
+    try:
+        with open(filename) as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return dict()
+
+
+def bench_micro(runs, threshold, baseline_file, save_opt):
+    """Run all microbenchmarks; return number of regressions."""
+
+    baseline = read_baseline(baseline_file)
+    results = dict()
+
+    print(
+        f"{'helper':<18} {'entries':>9} {'seconds':>9} {'entries/s':>12} "
+        f"{'baseline':>12}  status"
+    )
+    print('-' * 76)
+
+    failures = 0
+    for name, setup in MICRO_BENCHMARKS:
+        for n in MICRO_SIZES:
+            key = f"{name}/{n}"
+            try:
+                seconds = time_micro(setup, n, runs)
+            except ImportError as e:
+                print(f"{name:<18} {n:>9} skipped ({e})")
+                break
+
+            throughput = n / seconds
+            results[key] = throughput
+
+            if key not in baseline:
+                status = "no baseline"
+                base_str = "-"
+            else:
+                base_str = f"{baseline[key]:,.0f}"
+                change = (throughput / baseline[key] - 1) * 100
+                if change < -threshold:
+                    status = f"REGRESSED ({change:+.0f}%)"
+                    failures += 1
+                else:
+                    status = f"ok ({change:+.0f}%)"
+
+            print(
+                f"{name:<18} {n:>9} {seconds:>9.3f} {throughput:>12,.0f} "
+                f"{base_str:>12}  {status}"
+            )
+
+            if seconds > MICRO_TIME_LIMIT and n != MICRO_SIZES[-1]:
+                print(f"{name:<18} (larger sizes skipped: too slow)")
+                break
+
+    if save_opt:
+        baseline_dir = os.path.dirname(os.path.abspath(baseline_file))
+        os.makedirs(baseline_dir, exist_ok=True)
+        with open(baseline_file, 'w') as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+
+        print(f"\nBaseline saved to '{baseline_file}'")
+
+    return 0 if save_opt else failures
+
+
+def get_int_option(opts_dict, opt, default):
+    """Return integer argument of `opt`, or `default` if it's not available."""
+
+    arg = opts_dict.get(opt, default)
+    try:
+        return int(arg)
+    except ValueError:
+        print(f"ERROR: argument of `{opt}` must be an integer")
+        sys.exit(1)
+
+
+#==============================================================================
+#                       Main program
+#==============================================================================
+if __name__ == '__main__':
+    # Parse options
+    opts_dict = parse_options(
+        sys.argv, "hn:b:i:t:",
+        [
+            'startup', 'importtime', 'api', 'micro', 'baseline=',
+            'save-baseline'
+        ],
+        SYNTAX, daemon=False
+    )
+
+    runs = get_int_option(opts_dict, '-n', 5)
+    budget = get_int_option(opts_dict, '-b', 500)
+    import_budget = get_int_option(opts_dict, '-i', 100)
+    threshold = get_int_option(opts_dict, '-t', 20)
+    baseline_file = opts_dict.get('--baseline', MICRO_BASELINE)
+
+    failures = 0
+
+    # `--startup` option
+    if '--startup' in opts_dict:
+        failures += bench_startup(runs, budget)
+
+    # `--importtime` option
+    if '--importtime' in opts_dict:
+        failures += bench_imports(runs, import_budget)
+
+    # `--api` option
+    if '--api' in opts_dict:
+        failures += bench_api()
+
+    # `--micro` option
+    if '--micro' in opts_dict:
+        failures += bench_micro(
+            runs, threshold, baseline_file, '--save-baseline' in opts_dict
+        )
+
+    sys.exit(1 if failures else 0)
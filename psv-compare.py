@@ -8,13 +8,19 @@
 import os
 import sys
 
-from pennsieve.models import BaseCollection
 
 from psv_lib import (
-    EXTENSIONS,
-    psv,
+    LIMITER,
     psv_datasets,
     parse_options,
+    get_dataset,
+    get_file_name,
+    is_collection,
+    PathNode,
+    list_items,
+    resolve_packages,
+    walk_dataset,
+    get_all_keys,
 )
 
 SYNTAX = """
@@ -25,83 +31,55 @@ psv-compare.py -h (help)
                -d <dataset> (required)
                -i (optional, case-insensitive comparison)
                --data (optional, also compare data)
+               --index (optional, compare based on local index, see `psv-index.py`)
+               --async (optional, crawl datasets with asyncio, see `psv_async.py`)
 
 Note: `-c`, `-p` and `--all` are mutually exclusive.
 """
 
 
-def get_collections(element, collections, data_opt, indent=0):
-    """Get the contents of a dataset as a tree."""
+def get_collections(element, parent, nodes, data_opt):
+    """
+    Get the contents of a dataset as PathNodes, which are appended to
+    `nodes`.  `parent` is the node of `element` (None for the dataset).
+    """
 
     try:
         element._check_exists()
     except Exception:
         print(f"ERROR: {element} not exist on Pennsieve")
-        return
-
-    if indent > 0:
-        collections.append(f"{indent - 1}:{element.name}")
-        print(".", end="")
-
-    for item in element.items:
-        if isinstance(item, BaseCollection):
-            get_collections(item, collections, data_opt, indent=indent+1)
+        return nodes
+
+    # Resolve all packages in `element` at once
+    items = list_items(element)
+    packages = list()
+    if data_opt:
+        packages = resolve_packages(
+            x for x in items if not is_collection(x)
+        )
+    packages = iter(packages)
+
+    for item in items:
+        if is_collection(item):
+            node = PathNode(parent, item.name)
+            nodes.append(node)
+            print(".", end="")
+            get_collections(item, node, nodes, data_opt)
         elif data_opt:
-            pkg = psv.get(item)
+            pkg = next(packages)
             pkg_name = pkg.name
-            try:
-                real_name = str(pkg.sources[0].s3_key.split('/')[-1])
-            except:
+            real_name = pkg.real_name
+            if real_name is None:
                 print(
                     f"\nERROR: unable to get real name of package: "
-                    f"{elment.name}/{pkg_name}, so it will be ignored"
+                    f"{element.name}/{pkg_name}, so it will be ignored"
                 )
                 continue
 
-            real_ext = None
-            for ext in EXTENSIONS:
-                if real_name.lower().endswith(ext.lower()):
-                    real_ext = ext
-                    break
-
-            if real_ext is None:
-                real_ext = real_name.rsplit(".", 1)[-1]
-
-            if pkg_name[-len(real_ext):] == real_ext:
-                filename = pkg_name
-            else:
-                filename = pkg_name.replace(real_ext, "") + "." + real_ext
-
-            collections.append(f"{indent}:{filename}")
+            filename = get_file_name(pkg_name, real_name)
+            nodes.append(PathNode(parent, filename, item.id))
 
-    return collections
-
-
-def create_paths(the_list):
-    """Create a list of UNIX-like paths from Pennsieve dataset."""
-
-    paths = list()
-
-    for item in the_list:
-        colon = item.find(':')
-        indent = int(item[:colon])
-        collection = item[colon+1:]
-
-        if indent == 0:
-            path = [0] * 100
-            path[0] = collection
-            paths.append(collection)
-        else:
-            path[indent] = collection
-            p0 = path[0]
-
-            for i in range(1, indent + 1):
-                if path[i] != 0:
-                    p0 += "/" + path[i]
-
-            paths.append(p0)
-
-    return paths
+    return nodes
 
 
 def find(collection, paths, case_sensitive):
@@ -160,10 +138,17 @@ def get_ds_paths(dataset):
     """Get paths in input dataset."""
 
     print(f"\nGathering collections from '{dataset.name}'")
-    collections = []
-    ds_list = get_collections(dataset, collections, data_opt)
-    ds_paths = create_paths(ds_list)
-    ds_paths.sort()
+    if INDEX or ASYNC:
+        ds_nodes = list()
+        for node, pkg in walk_dataset(dataset, None, INDEX, data_opt):
+            if pkg is not None and pkg.error is not None:
+                print(f"ERROR: failed to resolve '{node.path}': {pkg.error}")
+            else:
+                ds_nodes.append(node)
+    else:
+        ds_nodes = get_collections(dataset, None, list(), data_opt)
+    ds_paths = sorted(x.path for x in ds_nodes)
+    print(f"\n{len(ds_paths)} paths gathered ({LIMITER.status()})")
 
     return ds_paths
 
@@ -180,7 +165,7 @@ def handle_d_option(d_arg):
         print(f"ERROR: dataset '{d_arg}' not found on Pennsieve")
         sys.exit(1)
 
-    dataset = psv.get_dataset(ds_name)
+    dataset = get_dataset(ds_name)
     ds_paths = get_ds_paths(dataset)
     return ds_paths
 
@@ -211,7 +196,7 @@ def handle_c_option(c_arg, d_arg, d_paths, case_sensitive, data_opt):
         print(f"ERROR: dataset '{c_arg}' not found on Pennsieve server")
         sys.exit(1)
 
-    c_dataset = psv.get_dataset(ds_name)
+    c_dataset = get_dataset(ds_name)
     compare_datasets(d_arg, d_paths, c_dataset, case_sensitive, data_opt)
 
 
@@ -232,12 +217,9 @@ def handle_p_option(p_arg, d_arg, d_paths, case_sensitive, data_opt):
 def handle_all_option(d_arg, d_paths, case_sensitive, data_opt):
     """Handle `--all` option."""
 
-    for k in sorted(psv_datasets):
-        if not k.startswith('HPAP-'):
-            continue
-
+    for k in get_all_keys():
         ds_name = psv_datasets[k]
-        c_dataset = psv.get_dataset(ds_name)
+        c_dataset = get_dataset(ds_name)
         compare_datasets(d_arg, d_paths, c_dataset, case_sensitive, data_opt)
 
 
@@ -246,7 +228,9 @@ def handle_all_option(d_arg, d_paths, case_sensitive, data_opt):
 #==============================================================================
 if __name__ == '__main__':
     # Parse options
-    opts_dict = parse_options(sys.argv, "hip:d:c:", ['all', 'data'], SYNTAX)
+    opts_dict = parse_options(
+        sys.argv, "hip:d:c:", ['all', 'data', 'index', 'async'], SYNTAX
+    )
 
     # `-i` option
     case_sensitive = '-i' not in opts_dict
@@ -256,6 +240,15 @@ if __name__ == '__main__':
     # `--data` option
     data_opt = '--data' in opts_dict
 
+    # `--index` option
+    INDEX = None
+    if '--index' in opts_dict:
+        from psv_index import PsvIndex
+        INDEX = PsvIndex()
+
+    # `--async` option
+    ASYNC = '--async' in opts_dict
+
     # `-c`, `-p` and `--all` options
     c_opt, p_opt, all_opt = get_c_p_all_options(opts_dict)
 
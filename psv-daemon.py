@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+#===============================================================================
+# Run a long-lived daemon that keeps an authenticated Pennsieve client, the
+# dataset catalog and dataset trees in memory, so that other `psv-*.py`
+# scripts send their work to it instead of starting from scratch (see
+# `psv_daemon.py`).
+#===============================================================================
+
+import os
+import subprocess
+import sys
+import time
+
+from psv_lib import DAEMON_SOCKET, parse_options
+from psv_daemon import TREE_TTL, connect, send_request, serve
+
+SYNTAX = f"""
+psv-daemon.py -h (help)
+              start (start the daemon in background)
+              serve (run the daemon in foreground)
+              stop (stop the daemon)
+              status (show status of the daemon)
+
+Note:
+  * Socket file: {DAEMON_SOCKET}
+    (can be changed by `PSV_DAEMON_SOCKET` environment variable)
+  * Dataset trees are trusted for {TREE_TTL} seconds
+    (can be changed by `PSV_DAEMON_TREE_TTL` environment variable)
+  * Scripts don't use the daemon if `PSV_DAEMON` environment variable is 0.
+"""
+
+# Log file of the daemon started by `start` command
+LOG_FILE = os.path.splitext(DAEMON_SOCKET)[0] + '.log'
+
+# Number of seconds to wait for the daemon to log in and load the catalog
+START_TIMEOUT = 120
+
+
+def send_command(command):
+    """
+    Send `command` to the daemon, and return its response, or None if the
+    daemon is not running.
+    """
+
+    sock = connect()
+    if sock is None:
+        return None
+
+    with sock:
+        return next(send_request(sock, {'command': command}), None)
+
+
+def handle_start():
+    """Handle `start` command."""
+
+    if send_command('status') is not None:
+        print(f"ERROR: psv-daemon is already running on {DAEMON_SOCKET}")
+        sys.exit(1)
+
+    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+    with open(LOG_FILE, 'a') as log:
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'serve'],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            print(f"ERROR: psv-daemon failed to start, see '{LOG_FILE}'")
+            sys.exit(1)
+
+        if send_command('status') is not None:
+            print(f"psv-daemon started (pid {proc.pid}), log: '{LOG_FILE}'")
+            return
+
+        time.sleep(0.1)
+
+    print(f"ERROR: psv-daemon not ready in {START_TIMEOUT} seconds")
+    sys.exit(1)
+
+
+def handle_stop():
+    """Handle `stop` command."""
+
+    if send_command('stop') is None:
+        print("ERROR: psv-daemon is not running")
+        sys.exit(1)
+
+    print("psv-daemon stopped")
+
+
+def handle_status():
+    """Handle `status` command."""
+
+    status = send_command('status')
+    if status is None:
+        print("psv-daemon is not running")
+        sys.exit(1)
+
+    print(
+        f"psv-daemon (pid {status['pid']}) running for "
+        f"{status['uptime']:.0f} seconds: {status['commands']} commands, "
+        f"{status['datasets']} datasets, {status['trees']} dataset trees"
+        f"{' (busy)' if status['busy'] else ''}"
+    )
+
+
+#==============================================================================
+#                       Main program
+#==============================================================================
+if __name__ == '__main__':
+    # The first argument is the command
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+
+    if command not in ['start', 'serve', 'stop', 'status']:
+        parse_options(sys.argv, "h", [], SYNTAX, daemon=False)
+        print("ERROR: invalid command")
+        print(SYNTAX)
+        sys.exit(1)
+
+    if command == 'start':
+        handle_start()
+    elif command == 'serve':
+        serve()
+    elif command == 'stop':
+        handle_stop()
+    else:
+        handle_status()
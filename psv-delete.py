@@ -9,12 +9,14 @@ import os
 import sys
 
 from psv_lib import (
-    psv,
     psv_datasets,
     parse_options,
     get_d_f_all_options,
-    collection_exists,
-    get_lines_in_file,
+    get_keys_in_file,
+    get_tree,
+    join_path,
+    run_datasets,
+    get_all_keys,
 )
 
 # Global variables
@@ -37,34 +39,24 @@ def delete_collection(ds_name, collection, deletion_location, force_opt):
     path = deletion_location if deletion_location else "root directory"
 
     # get to bottom collection in path
-    dataset = psv.get_dataset(ds_name)
-    dirs = deletion_location.split('/')
-
-    for d in dirs:
-        if d == "":
-            break  # add to root directory
-
-        if collection_exists(d, dataset):
-            dataset = dataset.get_items_by_name(d)[0]
-        else:
-            print(f"ERROR: collection '{d}' not exist")
-            sys.exit(1)
+    tree = get_tree(ds_name)
+    if tree.get(deletion_location) is None:
+        print(f"ERROR: collection '{deletion_location}' not exist")
+        sys.exit(1)
 
     # Ensure collection exists, and delete it if it is empty or `--force`
     # option is specified.
-    is_found = False
-    for item in dataset.items:
-        if item.name == collection:
-            is_found = True
-            break
-
-    if is_found:
-        if item.type != "Collection":
+    item_path = join_path(deletion_location, collection)
+    node = tree.get_node(item_path)
+
+    if node:
+        item = node.obj
+        if not node.is_collection:
             item.delete()
             print(
                 f"'{collection}' removed in '{path}' within dataset '{ds_name}'"
             )
-        elif len(item.items) == 0:
+        elif len(tree.children(node)) == 0:
             item.delete()
             print(
                 f"'{collection}' removed in '{path}' within dataset '{ds_name}'"
@@ -76,6 +68,9 @@ def delete_collection(ds_name, collection, deletion_location, force_opt):
             )
         else:
             print(f"'{collection}' NOT removed because it's not empty")
+            return
+
+        tree.remove(item_path)
     else:
         print(
             f"ERROR: Path '{path}/{collection}' not found within dataset "
@@ -119,22 +114,27 @@ def handle_d_option(d_arg, collection, deletion_location, force_opt):
 def handle_f_option(f_arg, collection, deletion_location, force_opt):
     """Handle `-f` option."""
 
-    keys = get_lines_in_file(f_arg)
+    keys = get_keys_in_file(f_arg)
 
-    for k in keys:
-        ds_name = psv_datasets[k]
-        delete_collection(ds_name, collection, deletion_location, force_opt)
+    return run_datasets(
+        lambda k: delete_collection(
+            psv_datasets[k], collection, deletion_location, force_opt
+        ),
+        keys
+    )
 
 
 def handle_all_option(collection, deletion_location, force_opt):
     """Handle `--all` option."""
 
-    for k in sorted(psv_datasets):
-        if not k.startswith('HPAP-'):
-            continue
+    keys = get_all_keys()
 
-        ds_name = psv_datasets[k]
-        delete_collection(ds_name, collection, deletion_location, force_opt)
+    return run_datasets(
+        lambda k: delete_collection(
+            psv_datasets[k], collection, deletion_location, force_opt
+        ),
+        keys
+    )
 
 
 #==============================================================================
@@ -162,8 +162,10 @@ if __name__ == '__main__':
     # `-f` option
     if f_opt:
         f_arg = opts_dict['-f']
-        handle_f_option(f_arg, collection, deletion_location, force_opt)
+        sys.exit(
+            handle_f_option(f_arg, collection, deletion_location, force_opt)
+        )
 
     # `--all` option
     if all_opt:
-        handle_all_option(collection, deletion_location, force_opt)
+        sys.exit(handle_all_option(collection, deletion_location, force_opt))
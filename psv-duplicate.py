@@ -9,9 +9,6 @@
 
 import sys
 
-from pennsieve import Pennsieve
-from pennsieve.models import BaseCollection, Collection
-
 from psv_lib import (
     psv,
     psv_datasets,
@@ -31,6 +28,9 @@ def create_duplicate(src_data, new_ds, indent=0):
     Clone all files in `original_ds` into `new_ds`.  Note that this is a
     recursive function.
     """
+
+    from pennsieve.models import BaseCollection, Collection
+
     try:
         src_data._check_exists()
     except Exception:
@@ -88,6 +88,11 @@ if __name__ == '__main__':
     # Parse options
     opts_dict = parse_options(sys.argv, "hd:n:", [], SYNTAX)
 
+    # `--select` only narrows down `--all` option, which is not available
+    if '--select' in opts_dict:
+        print("ERROR: `--select` option is not available")
+        sys.exit(1)
+
     # `-d` option
     d_arg = opts_dict.get('-d', None)
     original_ds = handle_d_option(d_arg)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+#===============================================================================
+# Maintain the local SQLite index of Pennsieve dataset trees, which can be
+# used by `psv-sync.py`, `psv-compare.py` and `psv-tree.py` (`--index` option)
+# instead of crawling datasets on Pennsieve server.
+#===============================================================================
+
+import sys
+from datetime import datetime
+
+from psv_lib import (
+    LIMITER,
+    psv_datasets,
+    parse_options,
+    get_d_f_all_options,
+    get_dataset,
+    get_keys_in_file,
+    get_all_keys,
+)
+from psv_index import INDEX_FILE, PsvIndex
+
+SYNTAX = f"""
+psv-index.py -h (help)
+             refresh (update the index of datasets whose content has changed)
+             status (show indexed datasets)
+
+Options of `refresh` command:
+             -d <dataset>
+             -f <file_containing_datasets>
+             --all (apply to ALL HPAP datasets)
+             --full (re-crawl datasets even if they have not changed)
+
+Note:
+  * `-d`, `-f` and `--all` options are mutually exclusive.
+  * Index file: {INDEX_FILE}
+    (can be changed by `PSV_INDEX_FILE` environment variable)
+"""
+
+
+def refresh_datasets(index, keys, full_opt):
+    """Refresh the index of datasets whose short names are in `keys`."""
+
+    for k in keys:
+        ds_name = psv_datasets[k]
+        dataset = get_dataset(ds_name)
+
+        if index.refresh(dataset, full=full_opt):
+            print(f"'{k}' indexed ({LIMITER.status()})")
+        else:
+            print(f"'{k}' not changed")
+
+    print()
+    for key, value in index.stats.items():
+        print(f"{key}: {value}")
+
+
+def handle_refresh(index, opts_dict):
+    """Handle `refresh` command."""
+
+    d_opt, f_opt, all_opt = get_d_f_all_options(opts_dict)
+    full_opt = '--full' in opts_dict
+
+    if d_opt:
+        d_arg = opts_dict['-d']
+        if d_arg not in psv_datasets:
+            print(f"ERROR: dataset '{d_arg}' not found on Pennsieve")
+            sys.exit(1)
+
+        keys = [d_arg]
+
+    if f_opt:
+        keys = get_keys_in_file(opts_dict['-f'])
+
+    if all_opt:
+        keys = get_all_keys()
+
+    refresh_datasets(index, keys, full_opt)
+
+
+def handle_status(index):
+    """Handle `status` command."""
+
+    for row in index.get_datasets():
+        indexed_at = datetime.fromtimestamp(row['indexed_at'])
+        print(
+            f"{row['name']}: {row['nodes']} objects, "
+            f"indexed at {indexed_at:%Y-%m-%d %H:%M:%S}"
+        )
+
+
+#==============================================================================
+#                       Main program
+#==============================================================================
+if __name__ == '__main__':
+    # The first argument is the command
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+
+    if command == 'status':
+        index = PsvIndex()
+        handle_status(index)
+        index.close()
+        sys.exit()
+
+    if command != 'refresh':
+        parse_options(sys.argv, "h", [], SYNTAX)
+        print("ERROR: invalid command")
+        print(SYNTAX)
+        sys.exit(1)
+
+    # Parse options after the command
+    opts_dict = parse_options(sys.argv[1:], "hd:f:", ['all', 'full'], SYNTAX)
+
+    index = PsvIndex()
+    handle_refresh(index, opts_dict)
+    index.close()
@@ -8,15 +8,15 @@
 import os
 import sys
 
-from pennsieve.models import Collection
-
 from psv_lib import (
-    psv,
     psv_datasets,
     parse_options,
     get_d_f_all_options,
-    collection_exists,
-    get_lines_in_file,
+    get_keys_in_file,
+    get_tree,
+    join_path,
+    run_datasets,
+    get_all_keys,
 )
 
 # Global variables
@@ -40,35 +40,25 @@ def insert_collection(ds_name, collection, insertion_location):
         path = insertion_location
 
     # Get to bottom collection in path
-    dataset = psv.get_dataset(ds_name)
-    dirs = insertion_location.split('/')
-
-    for d in dirs:
-        if d == "":
-            break  # add to root directory
-
-        if collection_exists(d, dataset):
-            dataset = dataset.get_items_by_name(d)[0]
-        else:
-            print(f"ERROR: Collection '{d}' not exist")
-            sys.exit(1)
+    tree = get_tree(ds_name)
+    dataset = tree.get(insertion_location)
+    if dataset is None:
+        print(f"ERROR: Collection '{insertion_location}' not exist")
+        sys.exit(1)
 
     # Ensure that collection does not exist before inserting it
-    is_found = False
-    for item in dataset.items:
-        if collection == item.name:
-            is_found = True
-            break
-
-    if is_found:
+    if tree.get(join_path(insertion_location, collection)) is not None:
         print(
             f"Collection '{collection}' already exists in '{path}' within "
             f"the dataset '{ds_name}'"
         )
         return
 
+    from pennsieve.models import Collection
+
     c = Collection(collection)
     dataset.add(c)
+    tree.add(insertion_location, c)
     print(f"Collection '{collection}' added to '{path}' within dataset '{ds_name}'")
 
 
@@ -107,22 +97,27 @@ def handle_d_option(d_arg, collection, insertion_location):
 def handle_f_option(f_arg, collection, insertion_location):
     """Handle `-f` option."""
 
-    input_keys = get_lines_in_file(f_arg)
+    input_keys = get_keys_in_file(f_arg)
 
-    for k in input_keys:
-        ds_name = psv_datasets[k]
-        insert_collection(ds_name, collection, insertion_location)
+    return run_datasets(
+        lambda k: insert_collection(
+            psv_datasets[k], collection, insertion_location
+        ),
+        input_keys
+    )
 
 
 def handle_all_option(collection, insertion_location):
     """Handle `--all` option."""
 
-    for k in sorted(psv_datasets):
-        if not k.startswith('HPAP-'):
-            continue
+    keys = get_all_keys()
 
-        ds_name = psv_datasets[k]
-        insert_collection(ds_name, collection, insertion_location)
+    return run_datasets(
+        lambda k: insert_collection(
+            psv_datasets[k], collection, insertion_location
+        ),
+        keys
+    )
 
 
 #==============================================================================
@@ -147,8 +142,8 @@ if __name__ == '__main__':
     # `-f` option
     if f_opt:
         f_arg = opts_dict['-f']
-        handle_f_option(f_arg, collection, insertion_location)
+        sys.exit(handle_f_option(f_arg, collection, insertion_location))
 
     # `--all` option
     if all_opt:
-        handle_all_option(collection, insertion_location)
+        sys.exit(handle_all_option(collection, insertion_location))
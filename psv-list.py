@@ -1,10 +1,30 @@
 #!/usr/bin/env python3
 
 """
-Print out the long names of all datasets on Pennsieve server.
+Print out the long names of all datasets on Pennsieve server, or those
+selected by `--select <expression>` (see `select_datasets()` in psv_lib).
 """
 
-from psv_lib import psv_datasets
+import sys
 
-for v in sorted(psv_datasets.values()):
+from psv_lib import (
+    psv_datasets,
+    parse_options,
+    select_datasets,
+    split_selection,
+)
+
+SYNTAX = """
+psv-list.py -h (help)
+            --refresh-catalog (fetch the dataset catalog from Pennsieve)
+            --select <expression> (only list the selected datasets)
+"""
+
+opts_dict = parse_options(sys.argv, "h", [], SYNTAX, empty=True)
+
+keys = psv_datasets
+if '--select' in opts_dict:
+    keys = select_datasets(split_selection(opts_dict['--select']))
+
+for v in sorted(psv_datasets[k] for k in keys):
     print(v)
@@ -11,12 +11,13 @@ import sys
 import time
 
 from psv_lib import (
-    psv,
     psv_datasets,
     parse_options,
     get_d_f_all_options,
-    collection_exists,
-    get_lines_in_file,
+    get_keys_in_file,
+    get_tree,
+    run_datasets,
+    get_all_keys,
 )
 
 # Global variables
@@ -87,18 +88,9 @@ def get_meta_lines(opts_dict):
 def get_one_dataset(ds_name, path):
     """Return the dataset based on `ds_name` and `path`."""
 
-    dataset = psv.get_dataset(ds_name)
-
-    dirs = path.split('/')
-    for d in dirs:
-        if d == "":
-            break
-
-        if not collection_exists(d, dataset):
-            print(f"ERROR: object '{d}' NOT exist")
-            return
-
-        dataset = dataset.get_items_by_name(d)[0]
+    dataset = get_tree(ds_name).get(path)
+    if dataset is None:
+        print(f"ERROR: object '{path}' NOT exist")
 
     return dataset
 
@@ -203,26 +195,29 @@ def handle_d_option(d_arg, p_arg, show_opt, remove_opt, meta_lines, c_arg, t_arg
 def handle_f_option(f_arg, p_arg, show_opt, remove_opt, meta_lines, c_arg, t_arg):
     """Handle `-f` option."""
 
-    input_keys = get_lines_in_file(f_arg)
+    input_keys = get_keys_in_file(f_arg)
 
-    for k in input_keys:
-        ds_name = psv_datasets[k]
-        process_meta(
-            ds_name, p_arg, show_opt, remove_opt, meta_lines, c_arg, t_arg
-        )
+    return run_datasets(
+        lambda k: process_meta(
+            psv_datasets[k], p_arg, show_opt, remove_opt, meta_lines, c_arg,
+            t_arg
+        ),
+        input_keys
+    )
 
 
 def handle_all_option(p_arg, show_opt, remove_opt, meta_lines, c_arg, t_arg):
     """Handle `--all` option."""
 
-    for k in sorted(psv_datasets):
-        if not k.startswith('HPAP-'):
-            continue
+    keys = get_all_keys()
 
-        ds_name = psv_datasets[k]
-        process_meta(
-            ds_name, p_arg, show_opt, remove_opt, meta_lines, c_arg, t_arg
-        )
+    return run_datasets(
+        lambda k: process_meta(
+            psv_datasets[k], p_arg, show_opt, remove_opt, meta_lines, c_arg,
+            t_arg
+        ),
+        keys
+    )
 
 
 #===============================================================================
@@ -261,10 +256,12 @@ if __name__ == '__main__':
     # Handle `-f` option
     if f_opt:
         f_arg = opts_dict['-f']
-        handle_f_option(
+        sys.exit(handle_f_option(
             f_arg, p_arg, show_opt, remove_opt, meta_lines, c_arg, t_arg
-        )
+        ))
 
     # Handle `--all` option
     if all_opt:
-        handle_all_option(p_arg, show_opt, remove_opt, meta_lines, c_arg, t_arg)
+        sys.exit(handle_all_option(
+            p_arg, show_opt, remove_opt, meta_lines, c_arg, t_arg
+        ))
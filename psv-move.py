@@ -13,8 +13,10 @@ from psv_lib import (
     psv_datasets,
     parse_options,
     get_d_f_all_options,
-    collection_exists,
-    get_lines_in_file,
+    get_keys_in_file,
+    get_tree,
+    run_datasets,
+    get_all_keys,
 )
 
 # Global variables
@@ -31,21 +33,15 @@ Note: `-d`, `-f` and `--all` options are mutually exlusive.
 """
 
 
-def locate_path(path, dataset):
+def locate_path(path, tree):
     """Return the object that represents where to start."""
 
-    dirs = path.split('/')
-
-    for d in dirs:
-        if d == "":
-            continue
-        elif collection_exists(d, dataset):
-            dataset = dataset.get_items_by_name(d)[0]
-        else:
-            print(f"ERROR: object '{path}' NOT exist")
-            sys.exit(1)
+    obj = tree.get(path)
+    if obj is None:
+        print(f"ERROR: object '{path}' NOT exist")
+        sys.exit(1)
 
-    return dataset
+    return obj
 
 
 def move_data(ds_key, src, dest):
@@ -56,29 +52,29 @@ def move_data(ds_key, src, dest):
         print(f"ERROR: dataset '{ds_key}' not found on Pennsieve")
         sys.exit(1)
 
-    dataset = psv.get_dataset(ds_name)
-    src_path= locate_path(src, dataset)
-    dest_path = locate_path(dest, dataset)
+    tree = get_tree(ds_name)
+    src_path= locate_path(src, tree)
+    dest_path = locate_path(dest, tree)
     psv.move(dest_path, src_path)
+    tree.remove(src)
+    tree.add(dest, src_path)
     print(f"'{ds_key}': '{src}' moved to '{dest}'")
 
 
 def handle_f_option(f_arg, src_arg, dest_arg):
     """Handle `-f` option."""
 
-    input_keys = get_lines_in_file(f_arg)
-    for k in input_keys:
-        move_data(k, src_arg, dest_arg)
+    input_keys = get_keys_in_file(f_arg)
+    return run_datasets(
+        lambda k: move_data(k, src_arg, dest_arg), input_keys
+    )
 
 
 def handle_all_option(src_arg, dest_arg):
     """Handle `-all` option."""
 
-    for k in sorted(psv_datasets):
-        if not k.startswith('HPAP-'):
-            continue
-
-        move_data(k, src_arg, dest_arg)
+    keys = get_all_keys()
+    return run_datasets(lambda k: move_data(k, src_arg, dest_arg), keys)
 
 
 #==============================================================================
@@ -107,8 +103,8 @@ if __name__ == '__main__':
     # `-f` option
     if f_opt:
         f_arg = opts_dict['-f']
-        handle_f_option(f_arg, src_arg, dest_arg)
+        sys.exit(handle_f_option(f_arg, src_arg, dest_arg))
 
     # `--all` option
     if all_opt:
-        handle_all_option(src_arg, dest_arg)
+        sys.exit(handle_all_option(src_arg, dest_arg))
@@ -9,12 +9,14 @@ import os
 import sys
 
 from psv_lib import (
-    psv,
     psv_datasets,
     parse_options,
     get_d_f_all_options,
-    collection_exists,
-    get_lines_in_file,
+    get_keys_in_file,
+    get_tree,
+    join_path,
+    run_datasets,
+    get_all_keys,
 )
 
 # Global variables
@@ -32,17 +34,14 @@ Note: `-d`, `-f` and `--all` options are mutually exlusive.
 
 
 def rename_object(ds_name, p_arg, n_arg, data_opt):
-    # Get to bottom collection in path
-    dataset = psv.get_dataset(ds_name)
-    dirs = p_arg.split('/')
-    obj = dirs[-1]
-
-    for d in dirs:
-        if collection_exists(d, dataset):
-            dataset = dataset.get_items_by_name(d)[0]
-        else:
-            printf("ERROR: dataset '{d}' NOT exist")
-            sys.exit(1)
+    # Get to bottom object in path
+    tree = get_tree(ds_name)
+    dataset = tree.get(p_arg)
+    obj = p_arg.split('/')[-1]
+
+    if dataset is None or dataset is tree.dataset:
+        print(f"ERROR: object '{p_arg}' NOT exist")
+        sys.exit(1)
 
     # Ensure that the object exists and is not a package before renaming it.
     if ":package:" in str(dataset.id):
@@ -52,11 +51,15 @@ def rename_object(ds_name, p_arg, n_arg, data_opt):
             print(f"Package '{obj}' renamed to '{n_arg}' within dataset '{ds_name}'")
         else:
             print("ERROR: please use `--data` to rename a package")
+            return
     else:
-        ds.name = newname
-        ds.update()
+        dataset.name = n_arg
+        dataset.update()
         print(f"Collection '{obj}' renamed to '{n_arg}' within dataset '{ds_name}'")
 
+    tree.remove(p_arg)
+    tree.add(join_path(p_arg).rpartition('/')[0], dataset)
+
 
 def handle_d_option(d_arg, p_arg, n_arg, data_opt):
     """Handle `-d` option."""
@@ -72,22 +75,23 @@ def handle_d_option(d_arg, p_arg, n_arg, data_opt):
 def handle_f_option(f_arg, p_arg, n_arg, data_opt):
     """Handle `-f` option."""
 
-    input_keys = get_lines_in_file(f_arg)
+    input_keys = get_keys_in_file(f_arg)
 
-    for k in input_keys:
-        ds_name = psv_datasets[k]
-        rename_object(ds_name, p_arg, n_arg, data_opt)
+    return run_datasets(
+        lambda k: rename_object(psv_datasets[k], p_arg, n_arg, data_opt),
+        input_keys
+    )
 
 
 def handle_all_option(p_arg, n_arg, data_opt):
     """Handle `-all` option."""
 
-    for k in sorted(psv_datasets):
-        if not k.startswith('HPAP-'):
-            continue
+    keys = get_all_keys()
 
-        ds_name = psv_datasets[k]
-        rename_object(ds_name, p_arg, n_arg, data_opt)
+    return run_datasets(
+        lambda k: rename_object(psv_datasets[k], p_arg, n_arg, data_opt),
+        keys
+    )
 
 
 #==============================================================================
@@ -123,8 +127,8 @@ if __name__ == '__main__':
     # `-f` option
     if f_opt:
         f_arg = opts_dict['-f']
-        handle_f_option(f_arg, p_arg, n_arg, data_opt)
+        sys.exit(handle_f_option(f_arg, p_arg, n_arg, data_opt))
 
     # `--all` option
     if all_opt:
-        handle_all_option(p_arg, n_arg, data_opt)
+        sys.exit(handle_all_option(p_arg, n_arg, data_opt))
@@ -10,22 +10,32 @@
 #===============================================================================
 
 import os
+import queue
+import stat
 import sys
+import threading
 import time
 
-from pennsieve.models import BaseCollection
-import pandas as pd
-import requests
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
 from psv_lib import (
     EXTENSIONS,
-    psv,
+    LIMITER,
+    PROFILE,
+    TRACE,
     psv_datasets,
     parse_options,
+    get_dataset,
+    get_file_name,
+    parse_timestamp,
+    is_collection,
     get_lines_in_file,
+    PathNode,
+    list_items,
+    resolve_packages,
+    walk_dataset,
+    get_all_keys,
 )
+from psv_download import PART_SUFFIX, download_source
+from psv_manifest import MANIFEST_NAME, SyncManifest, is_unchanged
 
 CATEGORIES = [
     "ATACseq",
@@ -50,7 +60,7 @@ CATEGORIES = [
 
 SYNTAX = """
 psv-sync.py -h (help)
-	    -q (quick sync, check existence of file before downloading)
+	    -q (quick sync, only download files that have changed)
             -c <category>
             -d <dataset>
             -o <output_path_for_local_storage> (default is $PWD)
@@ -59,6 +69,9 @@ psv-sync.py -h (help)
             --nodata (do not include data)
             --mirror (remove local data/directories to mirror dataset)
             --refresh (refresh HPAP website)
+            --index (plan from local index, see `psv-index.py`)
+            --async (crawl datasets with asyncio, see `psv_async.py`)
+            --jobs <N> (download up to N files concurrently, default: 1)
 
 Note:
   * `-d` and `--all` options are mutually exclusive.
@@ -86,10 +99,12 @@ Note:
 
 
 
-def get_collections(element, collections, indent=0):
+def get_collections(element, parent, nodes):
     """
-    Get contents of a dataset that will be processed later.  Note that
-    this is a recursive function.
+    Get contents of a dataset that will be processed later: append a
+    PathNode of each collection and package in `element` (whose node is
+    `parent`) to `nodes` (see DownloadPipeline), along with the PackageInfo
+    of each package.  Note that this is a recursive function.
     """
 
     try:
@@ -98,44 +113,38 @@ def get_collections(element, collections, indent=0):
         print(f"ERROR: {element} not exist on Pennsieve")
         sys.exit(1)
 
-    if indent > 0:
-        collections.append(f"{indent - 1}:{element.name}")
+    # Resolve all packages in `element` at once
+    items = list_items(element)
+    packages = resolve_packages(
+        x for x in items if not is_collection(x)
+    )
+    packages = iter(packages)
 
-    for item in element.items:
-        if isinstance(item, BaseCollection):
-            get_collections(item, collections, indent=indent+1)
+    for item in items:
+        if is_collection(item):
+            node = PathNode(parent, item.name)
+            nodes.append(node)
+            get_collections(item, node, nodes)
             continue
 
-        pkg = psv.get(item)
+        pkg = next(packages)
         pkg_name = pkg.name
-        try:
-            real_name = str(pkg.sources[0].s3_key.split('/')[-1])
-        except Exception:
+        real_name = pkg.real_name
+        if pkg.error is not None:
+            nodes.append(PathNode(parent, pkg_name, item.id), pkg)
+            continue
+
+        if real_name is None:
             print(
                 f"ERROR: unable to get real name of package: "
                 f"'{element.name}/{pkg_name}', ignored"
             )
             continue
 
-        real_ext = False
-        for ext in EXTENSIONS:
-            if real_name.lower().endswith(ext.lower()):
-                real_ext = ext
-                if real_ext == "bigWig":
-                    real_ext = "bw"
-                break
-
-        if real_ext == False:
-            real_ext = real_name.rsplit(".", 1)[-1]
-
-        if pkg_name[-len(real_ext):] == real_ext:
-            file_name = pkg_name
-        else:
-            file_name = pkg_name.replace(real_ext, "") + "." + real_ext
-
-        collections.append(f"{indent}:{file_name}:{item.id}")
+        file_name = get_file_name(pkg_name, real_name)
+        nodes.append(PathNode(parent, file_name, item.id), pkg)
 
-    return collections
+    return nodes
 
 
 def get_local_paths(root_path):
@@ -158,113 +167,271 @@ def get_local_paths(root_path):
     return sorted(paths)
 
 
-def create_paths(ds_key, the_list):
-    """Create a list of UNIX-like paths from Pennsieve dataset."""
+def check_package(pkg_info, file_path):
+    """
+    Check the package `pkg_info` against its local file `file_path`, which
+    costs a single `stat()` (so the output directory is never walked).
 
-    paths = list()
-    for item in the_list:
-        colon = item.find(':')
-        indent = int(item[:colon])
-        collection = item[colon+1:]
-
-        if indent == 0:
-            path = [0] * 100
-            path[0] = collection
-            paths.append(collection)
-        else:
-            path[indent] = collection
-            p0 = path[0]
-            for i in range(1, indent + 1):
-                if path[i] != 0:
-                    p0 += "/" + path[i]
-            paths.append(p0)
+    Return False if `file_path` is a regular file that has the same size
+    as the package's source file, and is not older than the package's
+    `updatedAt`; return True otherwise, which means the file will be
+    downloaded.
+    """
+
+    try:
+        info = os.stat(file_path)
+    except OSError:
+        return True
+
+    if not stat.S_ISREG(info.st_mode):
+        return True
 
-    paths = [f"{OUT_DIR}/{ds_key}/{p}" for p in paths]
-    return paths
+    if pkg_info.size is not None and info.st_size != pkg_info.size:
+        return True
 
+    updated_at = parse_timestamp(pkg_info.updated_at)
+    return updated_at is not None and info.st_mtime < updated_at
 
-def check_package(df, pkg_name, real_name):
+
+def download_pkg_file(source, file_path):
+    """
+    Download the source file `source` of a package to absolute path
+    `file_path` (resuming an interrupted download, see `psv_download.py`),
+    and return a tuple of (its size, its MD5 or None).
     """
-    Check the package in question against the recorded `df` dataframe.
 
-    Return False if the new package is found in `df`, AND `real_name` is
-    a regular file; return True otherwise, which means the file will be
-    downloaded.
+    local_dir, file_name = os.path.split(file_path)
+
+    with TRACE.span('download', 'download', file=file_name, dir=local_dir):
+        with PROFILE.timer('download') as call:
+            size, checksum = download_source(source, file_path)
+            call['bytes'] = size
+
+    return size, checksum
+
+
+def download_package(node, pkg_info, entry):
+    """
+    Download package `node` (whose PackageInfo is `pkg_info`, and manifest
+    entry is `entry`, or None); with `-q` option, it's not downloaded if
+    it's unchanged (see `psv_manifest.py`), or if it has no entry and
+    `check_package()` says so.  Return a tuple of
+    (outcome, result), where result is a tuple of (size, MD5) of a
+    downloaded file, or an error.
     """
 
-    if pkg_name in df.file_name_clean.values.tolist() and os.path.isfile(real_name):
-        return False
+    if pkg_info.source is None:
+        error = pkg_info.error or "unable to get source file of package"
+        return 'failed', error
 
-    return True
+    file_path = os.path.abspath(node.path)
+    if QUICK_SYNC:
+        if entry is None:
+            changed = check_package(pkg_info, file_path)
+        else:
+            changed = not is_unchanged(entry, pkg_info, file_path)
 
+        if not changed:
+            return 'unchanged', None
 
-def download_pkg_file(pkg, real_name, file_name, local_dir):
-    """Download files in a package."""
+    try:
+        local_dir = os.path.dirname(file_path)
+        if not os.path.isdir(local_dir):
+            with TRACE.span('makedirs', 'filesystem', dir=local_dir):
+                os.makedirs(local_dir, exist_ok=True)
 
-    print(f"Downloading '{file_name}' to {local_dir}'")
+        return 'downloaded', download_pkg_file(pkg_info.source, file_path)
+    except Exception as e:
+        return 'failed', e
 
-    download_name = pkg.sources[0].download(real_name)
-    download_name = str(download_name)
 
-    if download_name != file_name:
-        try:
-            os.rename(download_name, file_name)
-        except OSError:
-            print(
-                f"WARNING: failed to rename '{download_name}' to '{file_name}'"
+class DownloadPipeline:
+    """
+    Sink of PathNodes of datasets `ds_keys` that downloads packages while
+    the datasets are still being traversed: `get_ds_nodes()` appends nodes
+    to it, with the PackageInfo of each package that the traversal has
+    resolved.  Packages to download are batched by PIPELINE_SIZE packages
+    (the sources of those of the local index are requested by
+    `resolve_packages()` at this point), and put into a queue of up to
+    PIPELINE_SIZE packages, which DOWNLOAD_JOBS threads drain at the same
+    time (the traversal waits while the queue is full).  The outcome of
+    each package is printed and recorded in MANIFEST by the main thread,
+    whenever a batch is queued, and by `close()`.
+
+    A package that failed to be resolved (see `resolve_package()`) counts
+    as failed, and the local directory of its dataset is added to
+    `unresolved`, which `mirror()` leaves alone.
+    """
+
+    def __init__(self, ds_keys):
+        self.pending = list()
+        self.tasks = queue.Queue(PIPELINE_SIZE)
+        self.results = queue.Queue()
+
+        # Manifest entries of packages that have been downloaded (packages
+        # without an entry are checked by `check_package()`)
+        self.entries = MANIFEST.load(ds_keys) if WITH_DATA else dict()
+
+        # Nodes are only kept for operations after downloading
+        self.nodes = list()
+        self.keep_nodes = MIRROR or bool(EXCLUDED_PATHS)
+        self.pkg_ids = set()
+        self.unresolved = set()
+        self.count = 0
+
+        # Number of packages and bytes of each outcome
+        self.summary = {
+            x: [0, 0] for x in ['downloaded', 'unchanged', 'failed']
+        }
+        self.committed_at = time.time()
+
+        self.workers = list()
+        for i in range(DOWNLOAD_JOBS if WITH_DATA else 0):
+            worker = threading.Thread(
+                target=self._work, name=f"psv-download-{i}", daemon=True
             )
+            worker.start()
+            self.workers.append(worker)
 
+    def __len__(self):
+        return self.count
 
-def download_packages(pkg_paths, df=None):
-    """Download data from Pennsieve server to `pkg_paths`."""
+    def _work(self):
+        """Download packages in the queue until it's closed."""
 
-    root_dir = os.getcwd()
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
 
-    for path in pkg_paths:
-        path_list = path.split('/')
-        local_dir = '/'.join(path_list[:-1])
+            node, pkg_info = task
+            entry = self.entries.get(node.id)
+            self.results.put(
+                (node, pkg_info) + download_package(node, pkg_info, entry)
+            )
 
-        if not os.path.isdir(local_dir):
-            os.makedirs(local_dir)
+    def _put(self, task):
+        """Put `task` into the queue, reporting outcomes while it's full."""
+
+        while True:
+            try:
+                self.tasks.put(task, timeout=0.1)
+                return
+            except queue.Full:
+                self.report()
+
+    def append(self, node, pkg_info=None):
+        """
+        Create directory of collection `node`, or queue package `node`,
+        whose PackageInfo is `pkg_info` (its source is None if it hasn't
+        been requested yet).
+        """
+
+        self.count += 1
+        if self.keep_nodes:
+            self.nodes.append(node)
+
+        if not node.is_package:
+            path = node.path
+            if not os.path.isdir(path) and excluded(path):
+                with TRACE.span('makedirs', 'filesystem', dir=path):
+                    os.makedirs(path)
+            return
+
+        self.pkg_ids.add(node.id)
+        if pkg_info is not None and pkg_info.error is not None:
+            print(f"ERROR: failed to resolve '{node.path}': {pkg_info.error}")
+            self.summary['failed'][0] += 1
+
+            root = node
+            while root.parent is not None:
+                root = root.parent
+            self.unresolved.add(root.path)
+            return
+
+        if not WITH_DATA:
+            return
+        if CATEGORY_ARG and CATEGORY_ARG not in node.path:
+            return
+        if excluded(node.name) or excluded(node.id):
+            return
+
+        self.pending.append((node, pkg_info))
+        if len(self.pending) >= PIPELINE_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Request sources of pending packages if necessary, and queue them."""
+
+        unresolved = [x for _, x in self.pending if x.source is None]
+        resolved = iter(resolve_packages(unresolved))
+        for node, pkg_info in self.pending:
+            if pkg_info.source is None:
+                pkg_info = next(resolved)
+
+            self.report()
+            self._put((node, pkg_info))
+
+        self.pending.clear()
+
+    def report(self):
+        """Print and record outcomes of packages that have been processed."""
+
+        while True:
+            try:
+                node, pkg_info, outcome, result = self.results.get_nowait()
+            except queue.Empty:
+                break
 
-        os.chdir(local_dir)
+            file_path = os.path.abspath(node.path)
+            if outcome == 'downloaded':
+                print(f"Downloaded '{node.name}' to '{node.parent.path}'")
+                MANIFEST.record(pkg_info, file_path, result[1])
+                self.summary[outcome][1] += result[0]
+            elif outcome == 'unchanged':
+                print(f"Passing '{node.name}', no changes to file")
+                if node.id not in self.entries:
+                    MANIFEST.record(pkg_info, file_path)
+            else:
+                print(f"ERROR: failed to download '{node.path}': {result}")
 
-        pkg_id = path_list[-1]
-        pkg_list = pkg_id.split(':')
-        pkg_id = pkg_list[1:]
-        pkg_id = ':'.join(pkg_id)
+            self.summary[outcome][0] += 1
 
-        package = psv.get(pkg_id)
-        pkg_name = package.name
-        real_name = str(package.sources[0].s3_key.split('/')[-1])
+        # Commit once in a while, so that an interrupted run keeps most of
+        # what it has recorded
+        if WITH_DATA and time.time() - self.committed_at >= 1:
+            MANIFEST.commit()
+            self.committed_at = time.time()
 
-        real_ext = False
-        for ext in EXTENSIONS:
-            if real_name.lower().endswith(ext.lower()):
-                real_ext = ext
-                break
+    def close(self):
+        """
+        Wait for all packages to be processed, print a summary, and
+        return the number of packages that failed.
+        """
 
-        if real_ext == False:
-            real_ext = real_name.rsplit(".", 1)[-1]
+        self.flush()
+        for _ in self.workers:
+            self._put(None)
 
-        if pkg_name[-len(real_ext):] == real_ext:
-            file_name = pkg_name
-        else:
-            file_name = pkg_name.replace(real_ext, "") + "." + real_ext
+        for worker in self.workers:
+            while worker.is_alive():
+                worker.join(0.1)
+                self.report()
 
-        # Reset bigwig extension
-        if "bigWig" in file_name.rsplit(".", 1)[-1]:
-            file_name = file_name.replace(".bigWig", ".bw")
+        self.report()
+        if not WITH_DATA:
+            return self.summary['failed'][0]
 
-        if QUICK_SYNC:
-            if check_package(df, pkg_name, real_name):
-                download_pkg_file(package, real_name, file_name, local_dir)
-            else:
-                print(f"Passing '{file_name}', no changes to file")
-        else:
-            download_pkg_file(package, real_name, file_name, local_dir)
+        MANIFEST.commit()
+        summary = self.summary
+        print(
+            f"\n{summary['downloaded'][0]} files downloaded "
+            f"({summary['downloaded'][1] / 1e6:.1f} MB), "
+            f"{summary['unchanged'][0]} unchanged, "
+            f"{summary['failed'][0]} failed"
+        )
 
-        os.chdir(root_dir)
+        return summary['failed'][0]
 
 
 def excluded(item):
@@ -342,21 +509,32 @@ def get_excluded_paths(opts_dict):
     return get_lines_in_file(arg)
 
 
-def get_ds_paths(ds_key):
-    """Get dataset path from the dataset whse short name is `ds_key`."""
+def get_ds_nodes(ds_key, nodes):
+    """
+    Append PathNodes of all collections and packages in the dataset whose
+    short name is `ds_key` to `nodes` (a DownloadPipeline), in
+    depth-first order.  Their paths start with the local directory of the
+    dataset.
+    """
 
     print(f"Gathering Collections from '{ds_key}' ...")
 
-    ds_name = psv_datasets[ds_key]
-    dataset = psv.get_dataset(ds_name)
-    collections = list()
-    ds_list = get_collections(dataset, collections)
-    ds_paths = create_paths(ds_key, ds_list)
+    start = len(nodes)
+    with TRACE.span('get_ds_nodes', 'dataset', dataset=ds_key):
+        ds_name = psv_datasets[ds_key]
+        dataset = get_dataset(ds_name)
+        root = PathNode(None, f"{OUT_DIR}/{ds_key}")
+        if INDEX or ASYNC:
+            for node, pkg in walk_dataset(dataset, root, INDEX):
+                nodes.append(node, pkg)
+        else:
+            get_collections(dataset, root, nodes)
+    print(f"{len(nodes) - start} paths gathered ({LIMITER.status()})")
 
-    return ds_paths
+    return nodes
 
 
-def remove_excluded():
+def remove_excluded(ds_nodes):
     """Remove local files that are in excluded paths."""
 
     if not EXCLUDED_PATHS:
@@ -364,38 +542,62 @@ def remove_excluded():
 
     print("\nChecking for Excluded paths ...\n")
     for ep in EXCLUDED_PATHS:
-        match = [x for x in ds_paths if ep in x]
+        match = [
+            x for x in ds_nodes
+            if ep in x.path or (x.is_package and ep in x.id)
+        ]
         if len(match) > 0:
-            del_file = match[0].split(":", 1)[0]
+            del_file = match[0].path
             # Only one match for each file in excluded paths
             if os.path.isfile(del_file):
                 print(f"Removing '{ep}' ...")
                 os.remove(del_file)
 
 
-def mirror(ds_key, ds_paths):
-    """Mirror Pennsieve dataset and local directory."""
+def mirror(ds_key, ds_keys, ds_nodes, unresolved=()):
+    """
+    Mirror Pennsieve datasets `ds_keys` and their local directories.  If
+    `ds_key` is None and `--select` option is not given, all of OUT_DIR is
+    mirrored, so the directories of datasets that are no longer on
+    Pennsieve are removed too.  Nothing is removed from the directories in
+    `unresolved`, whose datasets have packages that failed to be resolved
+    (so they are not known to be gone).
+    """
 
     log_str = f"dataset '{ds_key}'" if ds_key else "all datasets"
     print(f"\nMirroring dataset '{log_str}' and '{OUT_DIR}' ...")
 
-    ds_paths.sort(reverse=True)
-    # Remove Pennsieve ":package:" ending to match local paths
-    ds_paths = [":".join(x.split(":", 2)[:2]) for x in ds_paths]
+    for path in sorted(unresolved):
+        print(f"WARNING: '{path}' not mirrored, some packages not resolved")
 
-    root_dir = OUT_DIR
-    if ds_key:
-        root_dir += '/' + ds_key
+    # Top-level nodes also keep the directory of their dataset, and
+    # packages keep their interrupted downloads
+    ds_paths = {x.path for x in ds_nodes}
+    ds_paths.update(x.parent.path for x in ds_nodes if x.parent)
+    ds_paths.update(x.path + PART_SUFFIX for x in ds_nodes if x.is_package)
+    ds_paths.add(f"{OUT_DIR}/{MANIFEST_NAME}")
+
+    if ds_key is None and not SELECTED:
+        root_dirs = [OUT_DIR]
+    else:
+        root_dirs = [f"{OUT_DIR}/{k}" for k in ds_keys]
 
-    local_paths = get_local_paths(root_dir, WITH_DATA)
+    local_paths = list()
+    for root_dir in root_dirs:
+        local_paths.extend(get_local_paths(root_dir))
     local_paths.sort(reverse=True)
 
+    # Children are removed before their parents, and parents that become
+    # empty are kept (unlike `os.removedirs()`) if they're on Pennsieve
     for lp in local_paths:
+        if any(lp == x or lp.startswith(x + '/') for x in unresolved):
+            continue
+
         if lp not in ds_paths:
             print(f"Removing '{lp}' because it does not exist on Pennsieve")
 
             if os.path.isdir(lp):
-                os.removedirs(lp)
+                os.rmdir(lp)
             else:
                 os.unlink(lp)
 
@@ -403,6 +605,10 @@ def mirror(ds_key, ds_paths):
 def refresh_hpap():
     """Send refresh signal to HPAP website."""
 
+    import requests
+    import urllib3
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
     hpap_url = 'https://hpap.pmacs.upenn.edu/services/refreshDirectories'
     resp = str(requests.put(hpap_url, verify=False))
 
@@ -412,52 +618,31 @@ def refresh_hpap():
         print(f"ERROR: PUT request failed: '{resp}' returned from {hpap_url}")
 
 
-def sync_data(ds_key, ds_paths):
-    """Sync input daset paths."""
+def sync_data(ds_key, ds_keys):
+    """
+    Sync collections and packages of datasets `ds_keys` (`ds_key` is None
+    if they are all datasets), and return the number of packages that
+    failed to download.  Packages are downloaded while the datasets are
+    traversed (see `DownloadPipeline`).
+    """
 
     print(f"\nCreating local directory structure in '{OUT_DIR}'")
+    if WITH_DATA:
+        print(f"Retrieving dataset packages to {OUT_DIR}\n")
+
+    start_time = time.time()
+    pipeline = DownloadPipeline(ds_keys)
+    with TRACE.span('sync_datasets', 'dataset', dataset=ds_key):
+        for k in ds_keys:
+            get_ds_nodes(k, pipeline)
 
-    ds_paths.sort()
-    for p in ds_paths:
-        if not os.path.isdir(p):
-            if ':package:' in p:
-                continue
-            if not excluded(p):
-                continue
-            os.makedirs(p)
+        failures = pipeline.close()
 
     # `--nodata` option is not available
     if WITH_DATA:
-        start_time = time.time()
-        pkg_paths = list()
-        print(f"\nRetrieving dataset packages to {OUT_DIR}")
-        for p in ds_paths:
-            if CATEGORY_ARG and CATEGORY_ARG not in p:
-                continue
-            if ":package:" not in p:
-                continue
-
-            pkg_split = p.rsplit("/", 1)[-1].split(":", 1)
-            file_name = pkg_split[0]
-            pkg_id = pkg_split[1]
-            if not excluded(file_name) and not excluded(pkg_id):
-                pkg_paths.append(p)
-
-        if QUICK_SYNC:  # `-q` option is available
-            hpap_files = []
-            for root, b, files in os.walk(OUT_DIR):
-                hpap_files.extend([[root, x] for x in files])
-
-            data_df = pd.DataFrame(hpap_files, columns=['root', 'file_name'])
-
-            data_df.loc[:, 'file_name_clean'] = data_df.file_name.apply(
-                remove_extension
-            )
-
-            download_packages(pkg_paths, data_df)
-
-        else: # `-q` option is not specified
-            download_packages(pkg_paths)
+        # Packages that are no longer on Pennsieve
+        MANIFEST.prune(ds_keys, pipeline.pkg_ids)
+        MANIFEST.commit()
 
         download_time = time.time() - start_time
         log_str = f"'{ds_key}'" if ds_key else "all donors"
@@ -465,16 +650,20 @@ def sync_data(ds_key, ds_paths):
 
     # Operations after file downloading:
     # (1) Remove files that are in excluded paths
-    remove_excluded()
+    with TRACE.span('remove_excluded', 'filesystem'):
+        remove_excluded(pipeline.nodes)
 
     # (2) mirroring if `--mirror` option is available
     if MIRROR:
-        mirror(ds_key, ds_paths)
+        with TRACE.span('mirror', 'filesystem', dataset=ds_key):
+            mirror(ds_key, ds_keys, pipeline.nodes, pipeline.unresolved)
 
     # (3) Send refresh signal if `--refresh` option is available
     if REFRESH:
         refresh_hpap()
 
+    return failures
+
 
 def handle_d_option(opts_dict):
     """Handle `-d <arg>` option."""
@@ -484,35 +673,26 @@ def handle_d_option(opts_dict):
         printf(f"ERROR: dataset '{arg}' not exist on Pennsieve")
         sys.exit(1)
 
-    ds_paths = get_ds_paths(ds_key)
-    sync_data(ds_key, ds_paths)
+    return sync_data(ds_key, [ds_key])
 
 
 def handle_all_option(opts_dict):
     """Handle `--all` option."""
 
     print("\nGathering all HPAP datasets ...")
-    ds_paths = []
-
-    for k in sorted(psv_datasets):
-        if not k.startswith('HPAP-'):
-            continue
-
-        tmp_paths = get_ds_paths(k)
-        ds_paths.extend(tmp_paths)
-
-    sync_data(None, ds_paths)
+    return sync_data(None, get_all_keys())
 
 
 #==============================================================================
 #                       Main program
 #==============================================================================
 if __name__ == '__main__':
-    # Parse options
+    # Parse options (downloads are not sent to `psv-daemon.py`, which runs
+    # one command at a time, so they would hold up all other scripts)
     opts_dict = parse_options(
         sys.argv,
-        "hqc:d:o:x:", ['all', 'mirror', 'nodata', 'refresh'],
-        SYNTAX
+        "hqc:d:o:x:", ['all', 'mirror', 'nodata', 'refresh', 'index', 'async'],
+        SYNTAX, daemon=False
     )
 
     d_opt, all_opt = get_d_all_options(opts_dict)  # `-d` and `--all` options
@@ -524,13 +704,36 @@ if __name__ == '__main__':
 
     QUICK_SYNC = '-q' in opts_dict
     MIRROR = '--mirror' in opts_dict
+    SELECTED = '--select' in opts_dict   # `--all` is narrowed by `--select`
     WITH_DATA = '--nodata' not in opts_dict
     REFRESH = 'refresh' in opts_dict
 
+    # Local index (based on `--index` option)
+    INDEX = None
+    if '--index' in opts_dict:
+        from psv_index import PsvIndex
+        INDEX = PsvIndex()
+
+    # Crawl datasets with asyncio (based on `--async` option)
+    ASYNC = '--async' in opts_dict
+
+    # Number of concurrent downloads (based on `--jobs` option), and the
+    # maximum number of packages waiting for them (see `DownloadPipeline`)
+    DOWNLOAD_JOBS = int(opts_dict.get('--jobs', 1))
+    PIPELINE_SIZE = 16 * DOWNLOAD_JOBS
+
+    # Files that have been downloaded to OUT_DIR (see `psv_manifest.py`)
+    MANIFEST = SyncManifest(OUT_DIR) if WITH_DATA else None
+
     # Handle `-d` option
     if d_opt:
-        handle_d_option(opts_dict)
+        failures = handle_d_option(opts_dict)
 
     # Handle `--all` option
     if all_opt:
-        handle_all_option(opts_dict)
+        failures = handle_all_option(opts_dict)
+
+    if MANIFEST:
+        MANIFEST.close()
+
+    sys.exit(1 if failures else 0)
@@ -10,15 +10,15 @@
 import sys
 from datetime import datetime
 
-from pennsieve.models import BaseCollection
-from termcolor import colored
-
 from psv_lib import (
-    collection_exists,
-    EXTENSIONS,
-    psv,
     psv_datasets,
     parse_options,
+    get_dataset,
+    get_file_name,
+    get_tree,
+    resolve_packages,
+    run_datasets,
+    get_all_keys,
 )
 
 VERSION = "0.7.0"
@@ -33,12 +33,21 @@ psv-tree.py -h: (help)
             --data: (optional) show packages in output
             --realdata: (optional) show packages as uploaded names
             --nocolor: (optional) disable color in output
+            --index: (optional) show local index, see `psv-index.py`
 
 Note: `-d` and `--all` options are mutually exclusive.
 """
 
 
-def print_tree(root, with_color, data_opt, real_opt, indent=0, verbose=True):
+def colored(text, color):
+    """Return `text` in `color`; termcolor is only imported if it's needed."""
+
+    from termcolor import colored
+
+    return colored(text, color)
+
+
+def print_tree(tree, root, with_color, data_opt, real_opt, indent=0):
     """
     Print the contents of a dataset as a tree.  Note that this is a
     recursive function.
@@ -47,14 +56,8 @@ def print_tree(root, with_color, data_opt, real_opt, indent=0, verbose=True):
     if root is None:
         return
 
-    try:
-        root._check_exists()
-    except Exception:
-        if verbose:
-            print(f"ERROR: object '{root}' not exist on Pennsieve")
-        return
-
-    count = len(root.items)
+    children = tree.children(root)
+    count = len(children)
     if count == 0:
         if with_color:
             pr_items = f" ({colored('empty', 'magenta')})"
@@ -75,39 +78,29 @@ def print_tree(root, with_color, data_opt, real_opt, indent=0, verbose=True):
     print_me += pr_items
     print(print_me)
 
-    for item in root.items:
-        if isinstance(item, BaseCollection):
-            print_tree(item, with_color, data_opt, real_opt, indent=indent+4)
+    # Get names of all packages in `root` at once
+    packages = list()
+    if data_opt:
+        packages = get_package_names(
+            [x.obj for x in children if not x.is_collection], real_opt
+        )
+    packages = iter(packages)
+
+    for node in children:
+        if node.is_collection:
+            print_tree(
+                tree, node, with_color, data_opt, real_opt, indent=indent+4
+            )
             continue
 
         if data_opt:
-            package = psv.get(item)
-            if real_opt:
-                pkg_name = package.sources[0].name
-            else:
-                pkg_name = package.name
-
-            try:
-                real_name = str(package.sources[0].s3_key.split('/')[-1])
-            except Exception:
+            pkg_name, real_name = next(packages)
+            if real_name is None:
                 print("ERROR: unable to get real name of package: ")
                 print(f"{root.name}/{pkg_name}, continuing...")
                 continue
 
-            real_ext = False
-            for ext in EXTENSIONS:
-                if real_name.lower().endswith(ext.lower()):
-                    real_ext = ext
-                    break
-
-            if real_ext == False:
-                real_ext = real_name.rsplit(".", 1)[-1]
-
-            if pkg_name[-len(real_ext):] == real_ext:
-                filename = pkg_name
-            else:
-                filename = pkg_name.replace(real_ext,"") + "." + real_ext
-
+            filename = get_file_name(pkg_name, real_name)
             if with_color:
                 print_me = " " * (indent + 4) + filename + colored(" (pkg)", "red")
             else:
@@ -116,25 +109,56 @@ def print_tree(root, with_color, data_opt, real_opt, indent=0, verbose=True):
             print(print_me)
 
 
-def locate_path(path, ds, verbose=True):
+def get_package_names(items, real_opt):
     """
-    Return the object that represents where to start printing the tree.
+    Return a list of (pkg_name, real_name) of packages in `items`, in
+    which `pkg_name` is the uploaded name if `real_opt` is True, and
+    `real_name` is the name of its source file on S3 (None if not
+    available).
     """
 
-    dirs = path.split('/')
+    if INDEX:
+        return [
+            (x.real_name if real_opt and x.real_name else x.name, x.real_name)
+            for x in items
+        ]
 
-    for d in dirs:
-        if d == "":
-            pass
-        elif collection_exists(d, ds):
-            ds = ds.get_items_by_name(d)[0]
+    names = list()
+    for pkg in resolve_packages(items):
+        if real_opt and pkg.source is not None:
+            names.append((pkg.source.name, pkg.real_name))
         else:
-            if verbose:
-                print(f"ERROR: object '{d}' NOT exist when locating the path")
+            names.append((pkg.name, pkg.real_name))
+
+    return names
+
 
-            return
+def get_ds_tree(ds_name):
+    """
+    Return the DatasetTree of dataset `ds_name`, which is based on the
+    local index if `--index` option is available.
+    """
+
+    if INDEX is None:
+        return get_tree(ds_name)
+
+    INDEX.refresh(get_dataset(ds_name))
+    return INDEX.get_tree(ds_name)
+
+
+def locate_path(path, tree, verbose=True):
+    """
+    Return the node that represents where to start printing the tree.
+    """
 
-    return ds
+    node = tree.get_node(path)
+    if node is None or not node.is_collection:
+        if verbose:
+            print(f"ERROR: object '{path}' NOT exist when locating the path")
+
+        return
+
+    return node
 
 
 def get_d_all_options(opts_dict):
@@ -154,35 +178,39 @@ def handle_d_option(d_arg, p_arg, with_color, data_opt, real_opt):
     """Handle `-d <dataset>` option."""
 
     if d_arg not in psv_datasets:
-        print(f"ERROR: Dataset '{arg}' not exist on Pennsieve")
+        print(f"ERROR: Dataset '{d_arg}' not exist on Pennsieve")
         sys.exit(1)
 
     ds_name = psv_datasets[d_arg]
-    dataset = psv.get_dataset(ds_name)
+    tree = get_ds_tree(ds_name)
+    root = tree.root
 
     if p_arg:  # `-p <path>` option is available
-        dataset = locate_path(p_arg, dataset)
+        root = locate_path(p_arg, tree)
 
-    print_tree(dataset, with_color, data_opt, real_opt)
+    print_tree(tree, root, with_color, data_opt, real_opt)
 
 
 def handle_all_option(p_arg, with_color, data_opt, real_opt):
     """Handle `--all` option."""
 
-    for k in sorted(psv_datasets):
-        if not k.startswith('HPAP-'):
-            continue
-
-        ds_name = psv_datasets[k]
-        dataset = psv.get_dataset(ds_name)
+    def show_tree(ds_key):
+        ds_name = psv_datasets[ds_key]
+        tree = get_ds_tree(ds_name)
+        root = tree.root
         if p_arg:  # `-p <path>` option is available
-            dataset = locate_path(p_arg, dataset, verbose=False)
+            root = locate_path(p_arg, tree, verbose=False)
 
-        if dataset:
+        if root:
             print()
             if p_arg:
                 print(f"{ds_name}: {p_arg}")
-            print_tree(dataset, with_color, data_opt, real_opt, verbose=False)
+            print_tree(tree, root, with_color, data_opt, real_opt)
+
+    # The local index is a single SQLite connection, which can't be shared
+    # by threads, so datasets are processed one by one with `--index`.
+    keys = get_all_keys()
+    return run_datasets(show_tree, keys, jobs=1 if INDEX else None)
 
 
 ###############################################################################
@@ -192,7 +220,7 @@ if __name__ == "__main__":
     # Parse options
     opts_dict = parse_options(
         sys.argv,
-        "hd:p:", ['all', 'data', 'nocolor', 'realdata'],
+        "hd:p:", ['all', 'data', 'nocolor', 'realdata', 'index'],
         SYNTAX
     )
 
@@ -209,6 +237,12 @@ if __name__ == "__main__":
     # `-p <path>` is also optional
     p_arg = opts_dict.get('-p', None)
 
+    # `--index` option (optional)
+    INDEX = None
+    if '--index' in opts_dict:
+        from psv_index import PsvIndex
+        INDEX = PsvIndex()
+
     # Handle `-d <dataset>` option
     if d_opt:
         d_arg = opts_dict['-d']
@@ -216,4 +250,4 @@ if __name__ == "__main__":
 
     # Handle `--all` option
     if all_opt:
-        handle_all_option(p_arg, with_color, data_opt, real_opt)
+        sys.exit(handle_all_option(p_arg, with_color, data_opt, real_opt))
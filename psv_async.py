@@ -0,0 +1,360 @@
+"""
+asyncio facade of Pennsieve client for metadata traversal.
+
+If `aiohttp` is installed (and the client is not a fake, see
+`psv_fake.py`), requests are sent directly to the same REST endpoints that
+Pennsieve client uses (authenticated by the client's token), so that
+hundreds of requests can be in flight on a single thread;
+otherwise Pennsieve client is called in up to MAX_WORKERS threads.
+Either way, requests in flight are limited by an AIMD window (see
+`AdaptiveLimiter` of `psv_lib`) of up to ASYNC_MAX_IN_FLIGHT requests,
+which shrinks when requests are throttled, and transient errors are
+retried within the retry budget of `psv_lib`.
+
+`crawl_dataset()` is a sync wrapper that crawls a whole dataset, so that
+scripts can use it without being asynchronous themselves.
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from psv_lib import (
+    MAX_WORKERS,
+    PROFILE,
+    RETRY_ATTEMPTS,
+    RETRY_BACKOFF,
+    RETRY_BACKOFF_CAP,
+    RETRY_STATS,
+    AdaptiveLimiter,
+    PackageInfo,
+    get_client,
+    get_endpoint_name,
+    is_retriable,
+    is_throttled,
+)
+
+from psv_http import get_client_session
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Whether the fallback to threads (without aiohttp) has been reported
+_fallback_reported = False
+
+# Maximum number of requests in flight, which is also where the window of
+# requests in flight starts (see `AsyncClient`)
+ASYNC_MAX_IN_FLIGHT = int(os.environ.get('PSV_ASYNC_MAX_IN_FLIGHT', 200))
+
+# A collection or package in a dataset
+Node = namedtuple('Node', ['id', 'name', 'type', 'updated_at'])
+
+# An entry of `AsyncClient.crawl()`: depth of `node` in the dataset (0 for
+# children of the dataset), and PackageInfo of `node` if it's a package
+# (None for collections, or if packages are not resolved).
+CrawlEntry = namedtuple('CrawlEntry', ['depth', 'node', 'package'])
+
+
+def node_from_dict(data):
+    """Return Node of a child in Pennsieve API's response."""
+
+    content = data.get('content', data)
+    return Node(
+        content.get('nodeId') or content['id'],
+        content['name'],
+        content.get('packageType'),
+        content.get('updatedAt'),
+    )
+
+
+def node_from_obj(obj):
+    """Return Node of a Pennsieve object."""
+
+    return Node(
+        obj.id, obj.name, getattr(obj, 'type', None),
+        getattr(obj, 'updated_at', None)
+    )
+
+
+def get_real_name(source):
+    """Return the name of Pennsieve file `source` on S3."""
+
+    return str(source.s3_key.split('/')[-1])
+
+
+class HTTPStatusError(Exception):
+    """Error response of aiohttp, which looks like `requests`' HTTPError."""
+
+    def __init__(self, status, url):
+        super().__init__(f"HTTP {status}: {url}")
+        self.response = type('Response', (), {'status_code': status})()
+
+
+class AsyncClient:
+    """
+    asyncio facade of Pennsieve client.  It must be used as an async
+    context manager:
+
+        async with AsyncClient() as client:
+            children = await client.list_children(dataset_id)
+
+    Requests in flight are limited by `limiter`, whose window starts at
+    `max_in_flight` (rather than growing from a few requests as LIMITER of
+    `psv_lib` does, which would take thousands of requests), is halved when
+    requests are throttled, and grows back as long as latency stays low.
+    """
+
+    def __init__(self, client=None, max_in_flight=ASYNC_MAX_IN_FLIGHT):
+        self.client = client or get_client()
+        self.max_in_flight = max_in_flight
+        self.limiter = AdaptiveLimiter(max_in_flight, maximum=max_in_flight)
+        self._released = None
+        self._session = None
+        self._executor = None
+
+    async def __aenter__(self):
+        global _fallback_reported
+
+        self._released = asyncio.Condition()
+        has_session = get_client_session(self.client) is not None
+        if aiohttp is not None and has_session:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+                raise_for_status=False,
+            )
+        else:
+            if has_session and not _fallback_reported:
+                print(
+                    "WARNING: aiohttp is not installed, so requests of "
+                    f"`--async` are sent in up to {MAX_WORKERS} threads"
+                )
+                _fallback_reported = True
+
+            self._executor = ThreadPoolExecutor(
+                MAX_WORKERS, thread_name_prefix='psv-async'
+            )
+
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    @asynccontextmanager
+    async def _slot(self):
+        """Same as `AdaptiveLimiter.slot()` of `limiter`, but asynchronous."""
+
+        async with self._released:
+            await self._released.wait_for(self.limiter.try_acquire)
+
+        start_time = time.perf_counter()
+        throttled = failed = False
+        try:
+            yield
+        except Exception as e:
+            throttled = is_throttled(e)
+            failed = True
+            raise
+        finally:
+            latency = time.perf_counter() - start_time
+            self.limiter.release(latency, throttled, failed)
+
+            # Only as many requests are woken up as the window has room for
+            room = self.limiter.limit - self.limiter.in_flight
+            async with self._released:
+                self._released.notify(max(room, 0))
+
+    async def _retry(self, func, *args):
+        """Await `func(*args)`, retrying transient errors with backoff."""
+
+        attempt = 1
+        while True:
+            try:
+                async with self._slot():
+                    return await func(*args)
+            except Exception as e:
+                if attempt >= RETRY_ATTEMPTS or not is_retriable(e):
+                    raise
+
+                backoff = RETRY_BACKOFF * 2 ** (attempt - 1)
+                delay = random.uniform(0, min(RETRY_BACKOFF_CAP, backoff))
+                if not RETRY_STATS.take(delay):
+                    raise
+
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _get_json(self, endpoint):
+        """GET `endpoint` of Pennsieve API, and return decoded response."""
+
+        api = self.client._api
+        url = f"{api._host}{endpoint}"
+
+        for reauthenticated in [False, True]:
+            start_time = time.perf_counter()
+            try:
+                async with self._session.get(
+                    url, headers=dict(api.session.headers)
+                ) as resp:
+                    body = await resp.read()
+                    if PROFILE.enabled:
+                        PROFILE.record(
+                            get_endpoint_name('GET', url),
+                            time.perf_counter() - start_time, len(body),
+                            failed=resp.status >= 400
+                        )
+
+                    if resp.status in [401, 403] and not reauthenticated:
+                        await asyncio.get_running_loop().run_in_executor(
+                            None, api.authenticate, api._organization
+                        )
+                        continue
+
+                    if resp.status not in [200, 201]:
+                        raise HTTPStatusError(resp.status, url)
+
+                    return json.loads(body)
+            except aiohttp.ClientConnectionError as e:
+                # Same as `requests`, so that it's retriable
+                from requests.exceptions import ConnectionError
+                raise ConnectionError(str(e)) from e
+
+    async def get(self, endpoint):
+        """GET `endpoint` of Pennsieve API (with retries)."""
+
+        return await self._retry(self._get_json, endpoint)
+
+    async def _in_thread(self, func, *args):
+        """Run `func(*args)` in a worker thread (with retries)."""
+
+        async def call():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+
+        return await self._retry(call)
+
+    async def list_children(self, node_id):
+        """Return a list of Nodes in the dataset or collection `node_id`."""
+
+        if self._session is None:
+            if node_id.startswith('N:dataset:'):
+                get = self.client._api.datasets.get
+            else:
+                get = self.client._api.packages.get
+
+            items = await self._in_thread(lambda: get(node_id).items)
+            return [node_from_obj(x) for x in items]
+
+        if node_id.startswith('N:dataset:'):
+            data = await self.get(f"/datasets/{node_id}")
+        else:
+            data = await self.get(f"/packages/{node_id}")
+
+        return [node_from_dict(x) for x in data.get('children', [])]
+
+    async def resolve_package(self, node):
+        """Return PackageInfo of package `node`."""
+
+        try:
+            if self._session is None:
+                sources = await self._in_thread(
+                    self.client._api.packages.get_sources, node.id
+                )
+            else:
+                from pennsieve.models import File
+
+                data = await self.get(f"/packages/{node.id}/sources")
+                sources = list()
+                for x in data:
+                    x['content'].update(pkg_id=node.id)
+                    sources.append(File.from_dict(x, api=self.client._api))
+
+            source = sources[0]
+            return PackageInfo(
+                node.id, node.name, get_real_name(source),
+                getattr(source, 'size', None), source, node.updated_at
+            )
+        except IndexError:
+            return PackageInfo(node.id, node.name, None, None, None)
+        except Exception as e:
+            return PackageInfo(node.id, node.name, None, None, None, error=e)
+
+    async def get_properties(self, node_id):
+        """
+        Return properties (metadata) of a dataset, collection or package
+        as a list of dicts with keys of 'key', 'value', 'dataType' and
+        'category'.
+        """
+
+        if node_id.startswith('N:dataset:'):
+            data = await self.get(f"/datasets/{node_id}")
+        else:
+            data = await self.get(f"/packages/{node_id}")
+
+        properties = list()
+        for entry in data.get('properties', []):
+            for p in entry.get('properties', [entry]):
+                properties.append({
+                    'key': p['key'],
+                    'value': p['value'],
+                    'dataType': p['dataType'],
+                    'category': entry['category'],
+                })
+
+        return properties
+
+    async def crawl(self, node_id, with_packages=True, depth=0):
+        """
+        Return a list of CrawlEntry of all descendants of the dataset or
+        collection `node_id`, in depth-first order.  Children of every
+        collection are listed (and packages resolved) concurrently.
+        """
+
+        children = await self.list_children(node_id)
+
+        tasks = list()
+        for node in children:
+            if node.type == 'Collection':
+                tasks.append(self.crawl(node.id, with_packages, depth + 1))
+            elif with_packages:
+                tasks.append(self.resolve_package(node))
+            else:
+                tasks.append(asyncio.sleep(0))
+
+        results = await asyncio.gather(*tasks)
+
+        entries = list()
+        for node, result in zip(children, results):
+            if node.type == 'Collection':
+                entries.append(CrawlEntry(depth, node, None))
+                entries.extend(result)
+            else:
+                entries.append(CrawlEntry(depth, node, result))
+
+        return entries
+
+
+def crawl_dataset(dataset, with_packages=True):
+    """
+    Return a list of CrawlEntry of all collections and packages in
+    `dataset` (a Pennsieve dataset or collection) in depth-first order,
+    which is the same order as a recursive crawl.
+    """
+
+    async def crawl():
+        async with AsyncClient() as client:
+            return await client.crawl(dataset.id, with_packages)
+
+    return asyncio.run(crawl())
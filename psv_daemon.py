@@ -0,0 +1,354 @@
+"""
+Long-lived daemon that keeps an authenticated Pennsieve client, the
+dataset catalog and DatasetTree snapshots in memory for `psv-*.py`
+scripts (see `psv-daemon.py`).
+
+The daemon listens on the Unix socket DAEMON_SOCKET of `psv_lib`.  When
+it's running, `parse_options()` sends the command line of a script to the
+daemon by `forward()`; the daemon runs the script in its own process,
+streams its output back, and the script exits with the same status, so
+that it doesn't log in, load the catalog or crawl datasets again.
+Commands are run one at a time, because they share the working directory,
+`sys.argv` and `sys.stdout` of the daemon.
+
+A request and the responses are JSON objects, one per line: a request is
+either {"argv": [...], "cwd": ..., "isatty": ...} to run a script, or
+{"command": "status" | "stop"}; responses of a script are {"out": text}
+for its output, and {"exit": status} at the end.  A script is aborted,
+by KeyboardInterrupt at its next output, once its client has gone (such
+as when the client is interrupted by Ctrl-C).
+"""
+
+import json
+import os
+import runpy
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+import psv_lib
+from psv_lib import (
+    DAEMON_SOCKET,
+    RETRY_STATS,
+    psv_datasets,
+    forget_trees,
+    get_client,
+)
+
+# Number of seconds that a DatasetTree snapshot is trusted by the daemon
+TREE_TTL = int(os.environ.get('PSV_DAEMON_TREE_TTL', 300))
+
+# Scripts that don't change datasets, which are the only ones that trust
+# snapshots for TREE_TTL seconds; other scripts (such as `psv-delete.py`)
+# crawl datasets again, so that they never change a dataset based on a
+# stale snapshot
+READ_ONLY_SCRIPTS = {
+    'psv-compare.py', 'psv-index.py', 'psv-list.py', 'psv-tree.py'
+}
+
+
+def connect():
+    """Return a socket connected to the daemon, or None if it's not running."""
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(DAEMON_SOCKET)
+    except OSError:
+        sock.close()
+        return None
+
+    return sock
+
+
+def send_request(sock, request):
+    """Send `request` to the daemon, and yield its responses."""
+
+    sock.sendall((json.dumps(request) + '\n').encode())
+    with sock.makefile('r', encoding='utf-8') as fd:
+        for line in fd:
+            yield json.loads(line)
+
+
+def forward(argv):
+    """
+    Run the command line `argv` of a script in the daemon and print its
+    output; return its exit status, or None if the daemon is not running.
+    """
+
+    sock = connect()
+    if sock is None:
+        return None
+
+    request = {
+        'argv': [os.path.abspath(argv[0])] + argv[1:],
+        'cwd': os.getcwd(),
+        'isatty': sys.stdout.isatty(),
+    }
+    with sock:
+        for response in send_request(sock, request):
+            if 'out' in response:
+                sys.stdout.write(response['out'])
+            elif 'exit' in response:
+                return response['exit']
+
+    print("ERROR: connection to psv-daemon lost")
+    return 1
+
+
+def get_exit_status(error):
+    """Return exit status of SystemExit `error`, like Python interpreter."""
+
+    if error.code is None or isinstance(error.code, int):
+        return error.code or 0
+
+    print(error.code)
+    return 1
+
+
+class ClientOutput:
+    """
+    Replacement of sys.stdout that sends what a script prints to a client.
+    Output is sent in chunks of up to OUTPUT_CHUNK characters, or at least
+    every OUTPUT_DELAY seconds so that progress is still shown.  Within
+    `aborting()`, output raises KeyboardInterrupt once the client has gone.
+    """
+
+    OUTPUT_CHUNK = 8192
+    OUTPUT_DELAY = 0.1
+
+    def __init__(self, fd, isatty):
+        self.fd = fd
+        self._isatty = isatty
+        self._buffer = list()
+        self._size = 0
+        self._sent_at = time.perf_counter()
+        self.lost = False   # whether the client has gone
+        self._aborting = False
+
+    def _send(self, response):
+        if self.lost:
+            return
+
+        try:
+            self.fd.write(json.dumps(response) + '\n')
+            self.fd.flush()
+        except OSError:
+            self.lost = True
+
+    def check_lost(self):
+        """Raise KeyboardInterrupt in `aborting()` if the client has gone."""
+
+        if self.lost and self._aborting:
+            raise KeyboardInterrupt
+
+    @contextmanager
+    def aborting(self):
+        """Context manager within which output checks the client."""
+
+        self._aborting = True
+        try:
+            yield
+        finally:
+            self._aborting = False
+
+    def write(self, text):
+        self.check_lost()
+        self._buffer.append(text)
+        self._size += len(text)
+        if (
+            self._size >= self.OUTPUT_CHUNK
+            or time.perf_counter() - self._sent_at >= self.OUTPUT_DELAY
+        ):
+            self.flush()
+
+        return len(text)
+
+    def flush(self):
+        if self._buffer:
+            self._send({'out': ''.join(self._buffer)})
+            self._buffer.clear()
+            self._size = 0
+
+        self._sent_at = time.perf_counter()
+        self.check_lost()
+
+    def isatty(self):
+        return self._isatty
+
+    def exit(self, status):
+        self.flush()
+        self._send({'exit': status})
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Server of `psv-daemon.py`."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(DAEMON_SOCKET, RequestHandler)
+
+        self.started_at = time.time()
+        self.commands = 0
+        self.run_lock = threading.Lock()
+
+    def server_bind(self):
+        # The socket is created as 0o600, so other users can't connect to
+        # it, not even before its mode could be changed
+        old_umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(old_umask)
+
+    def warm_up(self):
+        """Log in and load the dataset catalog."""
+
+        get_client()
+        print(f"psv-daemon: {len(psv_datasets)} datasets in catalog")
+
+    def run_script(self, request, output):
+        """Run the script of `request`, and return its exit status."""
+
+        argv = request['argv']
+        saved = (sys.argv, sys.stdout, os.getcwd())
+
+        # Catalog is revalidated (see `load_catalog()`), and old snapshots
+        # of datasets are crawled again, on every command; all snapshots
+        # are crawled again for a script that may change datasets
+        psv_datasets.reload()
+        if os.path.basename(argv[0]) in READ_ONLY_SCRIPTS:
+            forget_trees(TREE_TTL)
+        else:
+            forget_trees()
+        psv_lib.JOBS = 1
+        psv_lib.SELECTION = None
+
+        sys.argv = argv
+        sys.stdout = output
+        status = 1
+        try:
+            os.chdir(request['cwd'])
+            with output.aborting():
+                runpy.run_path(argv[0], run_name='__main__')
+            status = 0
+        except SystemExit as e:
+            status = get_exit_status(e)
+        except KeyboardInterrupt:
+            # Raised by `output` when the client has gone
+            print(f"psv-daemon: client of {argv[0]} has gone", file=sys.stderr)
+            status = 130
+        except Exception:
+            traceback.print_exc(file=output)
+            status = 1
+        finally:
+            # A command that failed may have left its trees half updated
+            if status != 0:
+                forget_trees()
+
+            if RETRY_STATS.retries or RETRY_STATS.given_up:
+                RETRY_STATS.report()
+                RETRY_STATS.reset()
+
+            sys.argv, sys.stdout = saved[:2]
+            os.chdir(saved[2])
+
+        return status
+
+    def status(self):
+        """Return a dict of the daemon's status."""
+
+        return {
+            'pid': os.getpid(),
+            'uptime': time.time() - self.started_at,
+            'commands': self.commands,
+            'datasets': len(psv_datasets),
+            'trees': forget_trees(TREE_TTL),
+            'busy': self.run_lock.locked(),
+        }
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Handler of a connection to the daemon."""
+
+    def watch(self, output):
+        """Mark `output` as lost once the client closes the connection."""
+
+        try:
+            while self.connection.recv(4096):
+                pass
+        except OSError:
+            pass
+
+        output.lost = True
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        request = json.loads(line)
+        writer = self.connection.makefile('w', encoding='utf-8')
+        server = self.server
+
+        command = request.get('command')
+        if command == 'status':
+            writer.write(json.dumps(server.status()) + '\n')
+        elif command == 'stop':
+            writer.write(json.dumps({'stopped': os.getpid()}) + '\n')
+            threading.Thread(target=server.shutdown).start()
+        elif 'argv' in request:
+            output = ClientOutput(writer, request.get('isatty', False))
+            threading.Thread(
+                target=self.watch, args=(output,), daemon=True
+            ).start()
+            with server.run_lock:
+                # The client may have gone while waiting for another command
+                if output.lost:
+                    writer.close()
+                    return
+
+                server.commands += 1
+                start_time = time.perf_counter()
+                status = server.run_script(request, output)
+                print(
+                    f"psv-daemon: {' '.join(request['argv'])} "
+                    f"(exit {status}, {time.perf_counter() - start_time:.3f} s)",
+                    file=sys.stderr
+                )
+
+            output.exit(status)
+
+        writer.close()
+
+
+def serve():
+    """Run the daemon until it's stopped."""
+
+    # Scripts that are run by the daemon must not send commands to it
+    os.environ['PSV_DAEMON'] = '0'
+
+    if os.path.exists(DAEMON_SOCKET):
+        sock = connect()
+        if sock is not None:
+            sock.close()
+            print(f"ERROR: psv-daemon is already running on {DAEMON_SOCKET}")
+            sys.exit(1)
+
+        # Left by a daemon that didn't stop cleanly
+        os.remove(DAEMON_SOCKET)
+
+    os.makedirs(os.path.dirname(DAEMON_SOCKET), exist_ok=True)
+    daemon = Daemon()
+    try:
+        daemon.warm_up()
+        print(f"psv-daemon: listening on {DAEMON_SOCKET}")
+        sys.stdout.flush()
+        daemon.serve_forever()
+    finally:
+        daemon.server_close()
+        os.remove(DAEMON_SOCKET)
@@ -0,0 +1,201 @@
+"""
+Resumable downloads of source files of Pennsieve packages.
+
+A source file is downloaded from its presigned URL on S3 to `<path>.part`
+next to its local path.  If a download is interrupted, the next attempt
+(a retry of `call_with_retry()`, or the next run of the script) keeps what
+is already in the `.part` file and requests the rest by an HTTP Range
+request.  The `.part` file is renamed to its local path only after it's
+verified:
+  * its size must be the size of the source file on Pennsieve;
+  * its MD5 must match the ETag of S3, if the ETag is an MD5 (which is not
+    the case for files that were uploaded in parts).
+A `.part` file that fails verification is removed, so that the next run
+downloads the file from scratch.
+"""
+
+import hashlib
+import os
+import re
+import threading
+
+from psv_lib import LIMITER, MAX_WORKERS, call_with_retry, get_client
+
+# Suffix of files that are being downloaded
+PART_SUFFIX = '.part'
+
+# Number of bytes read from the network (or a `.part` file) at a time
+CHUNK_SIZE = 1024 * 1024
+
+# Seconds to wait for a connection or a chunk of data from S3
+DOWNLOAD_TIMEOUT = 60
+
+# ETag of a file that was uploaded to S3 in one part, which is its MD5
+MD5_ETAG_RE = re.compile(r'^"?([0-9a-f]{32})"?$')
+
+# `requests` session of downloads, created by `get_session()`
+_session = None
+_session_lock = threading.Lock()
+
+
+class DownloadError(Exception):
+    """A downloaded file that doesn't match its source file."""
+
+
+def get_session():
+    """
+    Return the `requests` session of downloads, which keeps a connection
+    to S3 for each worker.  It's not the session of Pennsieve client, so
+    that its authentication headers are never sent to S3.
+    """
+
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            _session = requests.Session()
+            _session.mount('https://', HTTPAdapter(pool_maxsize=MAX_WORKERS))
+
+            # A fake client serves its own downloads (see `psv_fake.py`)
+            adapter = getattr(get_client(), 'download_adapter', None)
+            if adapter is not None:
+                _session.mount('fake://', adapter)
+
+        return _session
+
+
+def get_md5(filename):
+    """Return a hashlib MD5 object of the contents of `filename`."""
+
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(CHUNK_SIZE), b''):
+            md5.update(chunk)
+
+    return md5
+
+
+def get_checksum(resp):
+    """Return the MD5 in the ETag of S3 response `resp`, or None."""
+
+    match = MD5_ETAG_RE.match(resp.headers.get('ETag', '').lower())
+    return match.group(1) if match else None
+
+
+def get_url(source):
+    """
+    Return a presigned URL of source file `source`, which is requested from
+    Pennsieve server within the window of LIMITER (unlike the download from
+    S3 itself, which is limited by the number of download threads).
+    """
+
+    with LIMITER.slot():
+        return source.url
+
+
+def fetch_source(source, part_path):
+    """
+    Download the rest of source file `source` to `part_path`, starting
+    from the size of `part_path` (if it exists).  Return a tuple of (MD5
+    from the ETag of S3, MD5 object of `part_path`), which are both None if
+    the ETag is not an MD5.  An incomplete response raises ConnectionError,
+    so that it's retried (and resumed) by `call_with_retry()`.
+    """
+
+    from requests.exceptions import (
+        ChunkedEncodingError,
+        ConnectionError,
+        ContentDecodingError,
+    )
+
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if source.size is not None and offset > source.size:
+        # Not a part of the current source file
+        offset = 0
+
+    # A presigned URL expires, so a new one is requested by every attempt
+    session = get_session()
+    url = get_url(source)
+    if source.size is not None and 0 < offset == source.size:
+        # Nothing left to download, but it has to be verified against the
+        # ETag, which comes with the first byte (a presigned URL is only
+        # signed for GET, so S3 rejects HEAD requests)
+        with session.get(
+            url, headers={'Range': 'bytes=0-0'}, stream=True,
+            timeout=DOWNLOAD_TIMEOUT
+        ) as resp:
+            resp.raise_for_status()
+            checksum = get_checksum(resp)
+
+        return checksum, get_md5(part_path) if checksum else None
+
+    headers = {'Range': f"bytes={offset}-"} if offset else {}
+    with session.get(
+        url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT
+    ) as resp:
+        resp.raise_for_status()
+        if resp.status_code != 206:
+            # Range is not supported, so the whole file is sent
+            offset = 0
+
+        # MD5 of what's already downloaded is only needed to verify it
+        checksum, md5 = get_checksum(resp), None
+        if checksum:
+            md5 = get_md5(part_path) if offset else hashlib.md5()
+
+        expected = int(resp.headers.get('Content-Length', -1))
+        received = 0
+        with open(part_path, 'ab' if offset else 'wb') as fd:
+            try:
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    fd.write(chunk)
+                    if md5 is not None:
+                        md5.update(chunk)
+                    received += len(chunk)
+            except (ChunkedEncodingError, ContentDecodingError) as e:
+                raise ConnectionError(f"download interrupted: {e}") from e
+
+    if received < expected:
+        raise ConnectionError(
+            f"download interrupted after {offset + received} bytes"
+        )
+
+    return checksum, md5
+
+
+def verify_part(source, part_path, checksum, md5):
+    """
+    Verify downloaded file `part_path` against the size of its source file
+    `source` and MD5 `checksum` (if it's not None); remove it and raise
+    DownloadError if it doesn't match.
+    """
+
+    size = os.path.getsize(part_path)
+
+    error = None
+    if source.size is not None and size != source.size:
+        error = f"size {size} bytes, expected {source.size} bytes"
+    elif checksum is not None and md5.hexdigest() != checksum:
+        error = f"MD5 {md5.hexdigest()}, expected {checksum}"
+
+    if error:
+        os.remove(part_path)
+        raise DownloadError(f"'{part_path}' is corrupted ({error})")
+
+
+def download_source(source, file_path):
+    """
+    Download source file `source` of a package to `file_path` by way of
+    `<file_path>.part` (see above), and return a tuple of (its size, its
+    MD5 if it's verified, or None).
+    """
+
+    part_path = file_path + PART_SUFFIX
+    checksum, md5 = call_with_retry(fetch_source, source, part_path)
+    verify_part(source, part_path, checksum, md5)
+
+    os.replace(part_path, file_path)
+    return os.path.getsize(file_path), checksum
@@ -0,0 +1,565 @@
+"""
+In-process fake of Pennsieve client, so that scripts can be run (and
+benchmarked by `psv-bench.py --api`) without Pennsieve server.
+
+It's used by `psv_lib.get_client()` when environment variable PSV_FAKE is
+set to a comma-separated list of settings, such as
+"donors=200,packages=50,latency=0.02" (or "1" for default settings):
+  * donors: number of HPAP datasets (default: 10);
+  * categories: number of categories (top-level collections) in each
+    dataset (default: 18, at most 18);
+  * subdirs: number of collections in each category (default: 2);
+  * packages: number of packages in each of those collections (default: 20);
+  * size: size of each source file in bytes (default: 1024);
+  * latency: seconds that each call takes (default: 0);
+  * cutoff: number of bytes after which every download is interrupted, so
+    that it has to be resumed (default: 0, never);
+  * broken: every `broken`-th package of each collection fails to list
+    its sources with HTTP 500, however many times it's retried (default:
+    0, none).
+
+Datasets are generated (deterministically) the first time they are used,
+and changes made by scripts (new collections, moves, renames, deletions
+and properties) are kept until the process exits.
+
+Source files are downloaded from "fake://download/<package id>" URLs,
+which are served (with HTTP Range requests) by FakeDownloadAdapter that
+`psv_download.py` mounts on its session.
+
+Only the subset of Pennsieve client used by `psv-*.py` scripts is
+implemented.  Every call is counted by name in FakeClient.stats, which are
+written to the JSON file in environment variable PSV_FAKE_STATS at exit,
+along with the largest number of calls that were in flight at the same
+time (FakeClient.max_in_flight).
+"""
+
+import atexit
+import functools
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import BaseAdapter
+
+from psv_lib import PROFILE
+
+# Default settings of PSV_FAKE
+DEFAULT_SETTINGS = {
+    'donors': 10,
+    'categories': 18,
+    'subdirs': 2,
+    'packages': 20,
+    'size': 1024,
+    'latency': 0.0,
+    'cutoff': 0,
+    'broken': 0,
+}
+
+# Top-level collections of HPAP datasets
+CATEGORIES = [
+    "ATACseq",
+    "B cell receptor repertoire",
+    "Calcium imaging",
+    "Clinical data",
+    "CyTOF",
+    "Flow panels for B cells",
+    "Flow cytometry - Immune lineage",
+    "Histology",
+    "Imaging mass cytometry",
+    "Morphology and viability",
+    "mRNAseq",
+    "Oxygen consumption",
+    "Patch-Clamp",
+    "Perifusions",
+    "Sequencing data for sorted cells",
+    "Single-cell RNAseq",
+    "Tetramer Ag specific studies by FACS",
+    "WGBS",
+]
+
+# Extensions of source files, used in turn by packages
+FILE_EXTENSIONS = ['fastq.gz', 'ome.tiff', 'bigWig', 'csv', 'txt']
+
+# `updatedAt` of all generated objects
+UPDATED_AT = '2020-01-01T00:00:00.000000Z'
+
+
+def parse_settings(spec):
+    """Return a dict of settings based on the value of PSV_FAKE."""
+
+    settings = dict(DEFAULT_SETTINGS)
+    for token in spec.split(','):
+        key, sep, value = token.partition('=')
+        key = key.strip()
+        if not sep:
+            continue
+
+        if key not in settings:
+            raise ValueError(f"unknown setting of PSV_FAKE: '{key}'")
+
+        settings[key] = type(settings[key])(value)
+
+    settings['categories'] = min(settings['categories'], len(CATEGORIES))
+    return settings
+
+
+class FakeProperty:
+    """A property (metadata) of a fake object."""
+
+    def __init__(self, key, value, category, data_type):
+        self.key = key
+        self.value = value
+        self.category = category
+        self.data_type = data_type
+
+    def as_dict(self):
+        return {
+            'key': self.key,
+            'value': self.value,
+            'dataType': self.data_type,
+            'category': self.category,
+        }
+
+
+class FakeNode:
+    """A fake dataset, collection or package, backed by a record in FakeClient."""
+
+    def __init__(self, client, record):
+        self._client = client
+        self._record = record
+        self.id = record['id']
+        self.name = record['name']
+        self.type = record['type']
+        self.updated_at = UPDATED_AT
+
+    def __repr__(self):
+        return f"<Fake{self.type} name='{self.name}' id='{self.id}'>"
+
+    def _check_exists(self):
+        if self.id is None:
+            raise Exception("Object does not exist")
+
+    @property
+    def properties(self):
+        self._client._call('properties')
+        return list(self._record['properties'])
+
+    def insert_property(self, key, value, category='Pennsieve', data_type=None):
+        self._client._call('properties')
+        self._record['properties'] = [
+            x for x in self._record['properties']
+            if (x.key, x.category) != (key, category)
+        ]
+        self._record['properties'].append(
+            FakeProperty(key, value, category, data_type or 'string')
+        )
+
+    set_property = insert_property
+
+    def remove_property(self, key, category='Pennsieve'):
+        self._client._call('properties')
+        properties = self._record['properties']
+        for x in properties:
+            if (x.key, x.category) == (key, category):
+                properties.remove(x)
+                return
+
+        raise Exception(f"Property '{key}' does not exist")
+
+    def update(self):
+        self._client._call('update')
+        self._record['name'] = self.name
+
+    def delete(self):
+        self._client._call('delete')
+        self._client._remove(self.id)
+
+
+class FakeCollection(FakeNode):
+    """A fake collection, whose items are listed on first access."""
+
+    def __init__(self, client, record):
+        super().__init__(client, record)
+        self._items = None
+
+    @property
+    def items(self):
+        if self._items is None:
+            self._client._call('items')
+            self._items = self._client._children(self.id)
+
+        return self._items
+
+    def add(self, *items):
+        for item in items:
+            self._client._call('add')
+            record = self._client._create(item.name, 'Collection', self.id)
+
+            # Like Pennsieve client, `item` (a collection of the client)
+            # takes over the object that has been created, which is a fake
+            # one here, so that it can be listed and changed afterwards
+            created = self._client._wrap(record)
+            item.__class__ = type(created)
+            item.__dict__.update(created.__dict__)
+            if self._items is not None:
+                self._items.append(item)
+
+
+class FakeDataset(FakeCollection):
+    pass
+
+
+class FakeFile:
+    """A fake source file of a package."""
+
+    def __init__(self, client, record):
+        self._client = client
+        self.name = record['name']
+        self.s3_key = f"fake/{record['id']}/{record['real_name']}"
+        self.size = record['size']
+        self.pkg_id = record['id']
+
+    @property
+    def url(self):
+        # A presigned URL is requested from Pennsieve server
+        self._client._call('url')
+        return f"fake://download/{self.pkg_id}"
+
+
+class FakePackage(FakeNode):
+    """A fake package."""
+
+    @property
+    def sources(self):
+        return self._client._api.packages.get_sources(self)
+
+
+class FakeDatasetsAPI:
+    def __init__(self, client):
+        self._client = client
+
+    def get(self, ds_id):
+        return self._client._get_object(ds_id, 'get_dataset')
+
+
+class FakePackagesAPI:
+    def __init__(self, client):
+        self._client = client
+
+    def get(self, pkg_id):
+        return self._client._get_object(pkg_id, 'get')
+
+    def get_sources(self, pkg):
+        self._client._call('sources')
+        pkg_id = pkg if isinstance(pkg, str) else pkg.id
+        record = self._client._lookup(pkg_id)
+        if record is None or record['type'] == 'Collection':
+            raise Exception(f"Package '{pkg_id}' does not exist")
+
+        if record.get('broken'):
+            resp = requests.Response()
+            resp.status_code = 500
+            raise requests.HTTPError(
+                f"500 Server Error: sources of '{pkg_id}'", response=resp
+            )
+
+        return [FakeFile(self._client, record)]
+
+
+class FakeAPI:
+    """Fake of `Pennsieve._api` (only what `psv_lib` uses)."""
+
+    def __init__(self, client):
+        self._client = client
+        self.datasets = FakeDatasetsAPI(client)
+        self.packages = FakePackagesAPI(client)
+
+    def _get(self, endpoint, params=None):
+        if endpoint != '/datasets/paginated':
+            raise Exception(f"Endpoint '{endpoint}' is not faked")
+
+        self._client._call('catalog')
+        return {
+            'totalCount': self._client.settings['donors'],
+            'datasets': [{'content': {'updatedAt': UPDATED_AT}}],
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def get_fake_etag(size):
+    """Return ETag of a fake source file of `size` bytes (all zeros)."""
+
+    return f'"{hashlib.md5(bytes(size)).hexdigest()}"'
+
+
+class FakeDownloadAdapter(BaseAdapter):
+    """
+    Adapter of `requests` that serves source files of packages, which are
+    `size` zeros, like S3 does: with ETag, HEAD and Range requests.  With
+    `cutoff` setting, every response is cut off after `cutoff` bytes.
+    """
+
+    def __init__(self, client):
+        super().__init__()
+        self._client = client
+
+    def send(self, request, stream=False, **kwargs):
+        self._client._call('download')
+
+        resp = requests.Response()
+        resp.request = request
+        resp.url = request.url
+
+        record = self._client._lookup(request.url.split('/')[-1])
+        if record is None or record['type'] != 'Package':
+            resp.status_code = 404
+            resp.raw = io.BytesIO(b'')
+            return resp
+
+        size = record['size']
+        match = re.match(
+            r'bytes=(\d+)-(\d*)$', request.headers.get('Range', '')
+        )
+        start = int(match.group(1)) if match else 0
+        if start >= size and match:
+            resp.status_code = 416
+            resp.raw = io.BytesIO(b'')
+            return resp
+
+        end = size
+        if match and match.group(2):
+            end = min(int(match.group(2)) + 1, size)
+
+        body = bytes(end - start) if request.method == 'GET' else b''
+        resp.status_code = 206 if match else 200
+        resp.headers['Content-Length'] = str(end - start)
+        resp.headers['ETag'] = get_fake_etag(size)
+        if match:
+            resp.headers['Content-Range'] = f"bytes {start}-{end - 1}/{size}"
+
+        cutoff = self._client.settings['cutoff']
+        resp.raw = io.BytesIO(body[:cutoff] if cutoff else body)
+        return resp
+
+    def close(self):
+        pass
+
+
+class FakeClient:
+    """Fake of Pennsieve client."""
+
+    def __init__(self, **settings):
+        self.settings = dict(DEFAULT_SETTINGS, **settings)
+        self.stats = dict()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.RLock()
+        self._records = dict()
+        self._loaded = set()
+        self._next_id = 0
+        self._api = FakeAPI(self)
+        self.download_adapter = FakeDownloadAdapter(self)
+
+    def _call(self, name):
+        """Count a call of `name`, and wait for the configured latency."""
+
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        latency = self.settings['latency']
+        if latency > 0:
+            time.sleep(latency)
+
+        with self._lock:
+            self.in_flight -= 1
+
+        if PROFILE.enabled:
+            PROFILE.record(f"fake {name}", latency)
+
+    def dump_stats(self, filename):
+        """Write call counts and `max_in_flight` to JSON file `filename`."""
+
+        stats = {'calls': self.stats, 'max_in_flight': self.max_in_flight}
+        with open(filename, 'w') as fd:
+            json.dump(stats, fd, indent=2, sort_keys=True)
+
+    # Records of datasets, collections and packages
+
+    def _new_record(self, node_id, name, node_type, parent, **kwargs):
+        record = {
+            'id': node_id,
+            'name': name,
+            'type': node_type,
+            'parent': parent,
+            'children': [] if node_type != 'Package' else None,
+            'properties': [],
+        }
+        record.update(kwargs)
+        self._records[node_id] = record
+
+        if parent is not None:
+            self._records[parent]['children'].append(node_id)
+
+        return record
+
+    def _load_dataset(self, donor, with_tree=False):
+        """
+        Generate the record of dataset `donor` (starting from 1), and also
+        the records of its collections and packages if `with_tree` is True.
+        """
+
+        with self._lock:
+            prefix = f"HPAP-{donor:03d}"
+            ds_id = f"N:dataset:fake-{donor}"
+            if ds_id not in self._records and donor not in self._loaded:
+                self._new_record(ds_id, f"{prefix} fake donor", 'DataSet', None)
+
+            if not with_tree or donor in self._loaded:
+                return
+
+            self._loaded.add(donor)
+            for c in range(self.settings['categories']):
+                cat_id = f"N:collection:fake-{donor}-{c}"
+                self._new_record(cat_id, CATEGORIES[c], 'Collection', ds_id)
+
+                for s in range(self.settings['subdirs']):
+                    sub_id = f"{cat_id}-{s}"
+                    self._new_record(
+                        sub_id, f"Sample {s + 1}", 'Collection', cat_id
+                    )
+
+                    broken = self.settings['broken']
+                    for p in range(self.settings['packages']):
+                        ext = FILE_EXTENSIONS[p % len(FILE_EXTENSIONS)]
+                        name = f"{prefix}_{c + 1}_{s + 1}_{p + 1}"
+                        self._new_record(
+                            f"N:package:fake-{donor}-{c}-{s}-{p}", name,
+                            'Package', sub_id, real_name=f"{name}.{ext}",
+                            size=self.settings['size'],
+                            broken=broken > 0 and (p + 1) % broken == 0,
+                        )
+
+    def _lookup(self, node_id, with_tree=True):
+        """Return the record of `node_id`, or None if it doesn't exist."""
+
+        with self._lock:
+            if ':fake-' in node_id:
+                try:
+                    donor = int(node_id.split(':fake-')[1].split('-')[0])
+                except ValueError:
+                    return None
+
+                if 1 <= donor <= self.settings['donors']:
+                    self._load_dataset(donor, with_tree)
+
+            return self._records.get(node_id)
+
+    def _wrap(self, record):
+        """Return a new fake object of `record`."""
+
+        if record['type'] == 'DataSet':
+            return FakeDataset(self, record)
+        if record['type'] == 'Collection':
+            return FakeCollection(self, record)
+
+        return FakePackage(self, record)
+
+    def _get_object(self, node_id, call_name):
+        self._call(call_name)
+        record = self._lookup(node_id, with_tree=False)
+        if record is None:
+            record = self._lookup(node_id)
+
+        if record is None:
+            raise Exception(f"Object '{node_id}' does not exist")
+
+        return self._wrap(record)
+
+    def _children(self, node_id):
+        with self._lock:
+            record = self._lookup(node_id)
+            return [self._wrap(self._records[x]) for x in record['children']]
+
+    def _create(self, name, node_type, parent):
+        with self._lock:
+            self._next_id += 1
+            node_id = f"N:{node_type.lower()}:new-{self._next_id}"
+            return self._new_record(node_id, name, node_type, parent)
+
+    def _remove(self, node_id):
+        with self._lock:
+            record = self._records.pop(node_id)
+            if record['parent'] is not None:
+                self._records[record['parent']]['children'].remove(node_id)
+
+    # Public API of Pennsieve client
+
+    def datasets(self):
+        self._call('datasets')
+        for donor in range(1, self.settings['donors'] + 1):
+            self._load_dataset(donor)
+
+        return [
+            self._wrap(x) for x in list(self._records.values())
+            if x['type'] == 'DataSet'
+        ]
+
+    def get_dataset(self, name):
+        self._call('get_dataset')
+        for donor in range(1, self.settings['donors'] + 1):
+            self._load_dataset(donor)
+
+        for record in list(self._records.values()):
+            if record['type'] == 'DataSet' and name in [record['id'], record['name']]:
+                return self._wrap(record)
+
+        raise Exception(f"No dataset matching name or ID '{name}'")
+
+    def get(self, node_id):
+        try:
+            return self._get_object(node_id, 'get')
+        except Exception:
+            return None
+
+    def create_dataset(self, name):
+        self._call('create_dataset')
+        with self._lock:
+            self._next_id += 1
+            record = self._new_record(
+                f"N:dataset:new-{self._next_id}", name, 'DataSet', None
+            )
+
+        return self._wrap(record)
+
+    def move(self, destination, *things):
+        self._call('move')
+        with self._lock:
+            dest_id = getattr(destination, 'id', destination)
+            for x in things:
+                x_id = getattr(x, 'id', x)
+                record = self._records[x_id]
+                self._records[record['parent']]['children'].remove(x_id)
+                self._records[dest_id]['children'].append(x_id)
+                record['parent'] = dest_id
+
+
+def get_fake_client(spec):
+    """
+    Return FakeClient based on `spec` (the value of PSV_FAKE); its call
+    counts are written to PSV_FAKE_STATS (if set) at exit.
+    """
+
+    client = FakeClient(**parse_settings(spec))
+
+    stats_file = os.environ.get('PSV_FAKE_STATS')
+    if stats_file:
+        atexit.register(client.dump_stats, stats_file)
+
+    return client
@@ -0,0 +1,169 @@
+"""
+HTTP layer of Pennsieve client.
+
+The `requests` session of Pennsieve client is mounted with `PooledAdapter`,
+whose connection pools have an explicit size (matched to the number of
+concurrent workers), block instead of opening extra connections when all
+connections are busy, and count how connections are used:
+  * requests: number of requests sent;
+  * new connections: number of (TLS) connections opened;
+  * reused: number of requests sent on an existing connection;
+  * waits: number of times a request waited for a free connection.
+
+urllib3 connection pools are thread-safe, so the session can be shared by
+all threads of a script, and connections are reused across datasets.
+
+With `--profile` and `--trace` options, the adapter also records every
+request in `psv_lib.PROFILE` (see `get_endpoint_name()`) and `TRACE`.
+"""
+
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from psv_lib import PROFILE, TRACE, get_endpoint_name
+
+# Number of hosts whose connection pools are kept by each adapter
+POOL_CONNECTIONS = 4
+
+
+class PoolStats:
+    """Thread-safe counters of connection pools."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def add(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    @property
+    def reused(self):
+        return max(self.requests - self.new_connections, 0)
+
+    def report(self):
+        """Return the counters as a printable string."""
+
+        return (
+            f"HTTP connection pool: {self.requests} requests, "
+            f"{self.new_connections} new connections, {self.reused} reused, "
+            f"{self.waits} waits ({self.wait_time:.2f} seconds)"
+        )
+
+
+# Counters of all connection pools
+POOL_STATS = PoolStats()
+
+
+class CountingPoolMixin:
+    """Mixin of urllib3 connection pool that updates POOL_STATS."""
+
+    def _new_conn(self):
+        POOL_STATS.add('new_connections')
+        return super()._new_conn()
+
+    def _get_conn(self, timeout=None):
+        # All connections are in use, so this request has to wait.
+        if self.pool is not None and self.pool.empty():
+            start_time = time.perf_counter()
+            conn = super()._get_conn(timeout)
+            POOL_STATS.add('waits')
+            POOL_STATS.add('wait_time', time.perf_counter() - start_time)
+            return conn
+
+        return super()._get_conn(timeout)
+
+    def urlopen(self, *args, **kwargs):
+        POOL_STATS.add('requests')
+        return super().urlopen(*args, **kwargs)
+
+
+class CountingHTTPConnectionPool(CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class CountingHTTPSConnectionPool(CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connection pools update POOL_STATS, and which
+    records requests in PROFILE and TRACE (if they are enabled).
+    """
+
+    def send(self, request, stream=False, **kwargs):
+        if not PROFILE.enabled and not TRACE.enabled:
+            return super().send(request, stream=stream, **kwargs)
+
+        name = get_endpoint_name(request.method, request.url)
+        start_time = time.perf_counter()
+        try:
+            with TRACE.span(name, 'http'):
+                resp = super().send(request, stream=stream, **kwargs)
+
+                # Read the body here (instead of in `Session.send()`), so
+                # that it's included in the latency.
+                if stream:
+                    nbytes = int(resp.headers.get('Content-Length', 0))
+                else:
+                    nbytes = len(resp.content)
+        except Exception:
+            if PROFILE.enabled:
+                PROFILE.record(
+                    name, time.perf_counter() - start_time, failed=True
+                )
+            raise
+
+        if PROFILE.enabled:
+            PROFILE.record(
+                name, time.perf_counter() - start_time, nbytes,
+                failed=resp.status_code >= 400
+            )
+        return resp
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+def configure_session(session, pool_size):
+    """
+    Mount PooledAdapter that keeps up to `pool_size` connections per host
+    on `session`, and return `session`.
+    """
+
+    # Keep retry policy of the adapter that is being replaced
+    max_retries = session.get_adapter('https://').max_retries
+
+    adapter = PooledAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=pool_size,
+        pool_block=True,
+        max_retries=max_retries,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+def get_client_session(client):
+    """Return the `requests` session of Pennsieve `client` (None if not found)."""
+
+    api = getattr(client, '_api', None)
+    for attr in ['session', '_session']:
+        session = getattr(api, attr, None)
+        if session is not None and hasattr(session, 'mount'):
+            return session
+
+    return None
@@ -0,0 +1,302 @@
+"""
+Local SQLite index of Pennsieve dataset trees.
+
+The index keeps every collection and package of the indexed datasets
+(id, parent, name, real S3 name, size and updatedAt), so that scripts can
+plan their work without crawling the datasets on Pennsieve server.
+
+`PsvIndex.refresh()` only re-crawls what has changed since the last
+refresh: a dataset whose `updatedAt` has not changed costs one request.
+In a dataset that has changed, collections are listed again (one request
+each), but only the packages whose `updatedAt` has changed are resolved,
+which is where most of the requests of a live crawl go.  `full=True`
+re-crawls everything.
+"""
+
+import os
+import sqlite3
+import time
+
+from psv_lib import (
+    DatasetTree,
+    is_collection,
+    list_items,
+    resolve_packages,
+)
+
+# Location of the index database
+INDEX_FILE = os.path.expanduser(
+    os.environ.get('PSV_INDEX_FILE', '~/.pennsieve/psv_index.db')
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    name TEXT PRIMARY KEY,
+    id TEXT NOT NULL,
+    updated_at TEXT,
+    indexed_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS nodes (
+    id TEXT PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    is_collection INTEGER NOT NULL,
+    real_name TEXT,
+    size INTEGER,
+    updated_at TEXT
+);
+
+CREATE INDEX IF NOT EXISTS nodes_parent ON nodes (parent);
+CREATE INDEX IF NOT EXISTS nodes_dataset ON nodes (dataset);
+"""
+
+
+def get_updated_at(obj):
+    """Return `updatedAt` of a Pennsieve object, or None if not available."""
+
+    value = getattr(obj, 'updated_at', None)
+    if value is None:
+        return None
+
+    return str(value)
+
+
+class IndexedObject:
+    """A collection or package in the index, used in place of Pennsieve object."""
+
+    __slots__ = ('id', 'name', 'type', 'real_name', 'size', 'updated_at')
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.name = row['name']
+        self.type = 'Collection' if row['is_collection'] else 'Package'
+        self.real_name = row['real_name']
+        self.size = row['size']
+        self.updated_at = row['updated_at']
+
+    def __repr__(self):
+        return f"<IndexedObject {self.type} '{self.name}' ({self.id})>"
+
+
+class PsvIndex:
+    """Local SQLite index of Pennsieve dataset trees."""
+
+    def __init__(self, filename=INDEX_FILE):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+
+        self.db = sqlite3.connect(filename)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+        # Counters of the work done by `refresh()`
+        self.stats = {
+            'datasets skipped': 0,
+            'collections listed': 0,
+            'packages resolved': 0,
+            'packages skipped': 0,
+            'packages failed': 0,
+            'nodes removed': 0,
+        }
+
+        # Errors of packages that `refresh()` failed to resolve, by id;
+        # they keep what was indexed before, if anything
+        self.failed = dict()
+
+    def close(self):
+        self.db.close()
+
+    def get_dataset(self, ds_name):
+        """Return the row of dataset `ds_name`, or None if not indexed."""
+
+        return self.db.execute(
+            "SELECT * FROM datasets WHERE name = ?", (ds_name,)
+        ).fetchone()
+
+    def get_datasets(self):
+        """Return rows of all indexed datasets and their number of nodes."""
+
+        return self.db.execute(
+            "SELECT d.*, COUNT(n.id) AS nodes FROM datasets d "
+            "LEFT JOIN nodes n ON n.dataset = d.name "
+            "GROUP BY d.name ORDER BY d.name"
+        ).fetchall()
+
+    def refresh(self, dataset, full=False):
+        """
+        Update the index of Pennsieve `dataset`, and return True if it has
+        changed since it was indexed.  Each dataset is updated in a single
+        transaction, so an interrupted refresh never leaves it half indexed.
+        """
+
+        row = self.get_dataset(dataset.name)
+        updated_at = get_updated_at(dataset)
+
+        if (
+            not full and row is not None and row['id'] == dataset.id
+            and updated_at is not None and row['updated_at'] == updated_at
+        ):
+            self.stats['datasets skipped'] += 1
+            return False
+
+        with self.db:
+            if row is not None and row['id'] != dataset.id:
+                self.db.execute(
+                    "DELETE FROM nodes WHERE dataset = ?", (dataset.name,)
+                )
+
+            # A dataset with packages that failed is refreshed again next time
+            failed = len(self.failed)
+            self._refresh_children(dataset.name, dataset, full)
+            if len(self.failed) > failed:
+                updated_at = None
+
+            self.db.execute(
+                "INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?)",
+                (dataset.name, dataset.id, updated_at, time.time()),
+            )
+
+        return True
+
+    def _refresh_children(self, ds_name, parent, full):
+        """Update the index of children of `parent` (recursively)."""
+
+        indexed = {
+            r['id']: r for r in self.db.execute(
+                "SELECT id, updated_at, real_name FROM nodes WHERE parent = ?",
+                (parent.id,)
+            )
+        }
+
+        items = list_items(parent)
+        self.stats['collections listed'] += 1
+
+        # Packages that are new or have changed are resolved at once
+        changed = list()
+        for item in items:
+            prev = indexed.get(item.id)
+            if is_collection(item):
+                continue
+
+            if (
+                full or prev is None or prev['real_name'] is None
+                or get_updated_at(item) is None
+                or prev['updated_at'] != get_updated_at(item)
+            ):
+                changed.append(item)
+
+        resolved = {
+            item.id: pkg for item, pkg in zip(changed, resolve_packages(changed))
+        }
+        self.stats['packages resolved'] += len(changed)
+
+        for position, item in enumerate(items):
+            prev = indexed.pop(item.id, None)
+            updated_at = get_updated_at(item)
+            pkg = resolved.get(item.id)
+
+            if is_collection(item):
+                real_name, size = None, None
+                self._refresh_children(ds_name, item, full)
+            elif pkg is not None and pkg.error is not None:
+                self.failed[item.id] = pkg.error
+                self.stats['packages failed'] += 1
+                real_name, size = None, None
+                if prev is not None:
+                    real_name = prev['real_name']
+                    updated_at = prev['updated_at']
+            elif pkg is not None:
+                real_name, size = pkg.real_name, pkg.size
+            else:
+                real_name, size = prev['real_name'], None
+                self.stats['packages skipped'] += 1
+
+            self.db.execute(
+                "INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET "
+                "dataset = excluded.dataset, parent = excluded.parent, "
+                "position = excluded.position, name = excluded.name, "
+                "is_collection = excluded.is_collection, "
+                "real_name = excluded.real_name, "
+                "size = COALESCE(excluded.size, nodes.size), "
+                "updated_at = excluded.updated_at",
+                (
+                    item.id, ds_name, parent.id, position, item.name,
+                    is_collection(item), real_name, size, updated_at,
+                ),
+            )
+
+        # Remove nodes that no longer exist on Pennsieve
+        for node_id in indexed:
+            self._remove(node_id)
+
+    def _remove(self, node_id):
+        """Remove the node whose id is `node_id` and all its descendants."""
+
+        changes = self.db.total_changes
+        self.db.execute(
+            "WITH RECURSIVE sub(id) AS ("
+            "  SELECT ? UNION ALL "
+            "  SELECT n.id FROM nodes n JOIN sub ON n.parent = sub.id"
+            ") DELETE FROM nodes WHERE id IN sub",
+            (node_id,)
+        )
+        self.stats['nodes removed'] += self.db.total_changes - changes
+
+    def walk(self, ds_name):
+        """
+        Yield a tuple of (depth, row) for each node in dataset `ds_name`
+        in depth-first order, which is the same order as a live crawl.
+        Children of the dataset itself are at depth 0.
+        """
+
+        ds_row = self.get_dataset(ds_name)
+        if ds_row is None:
+            return
+
+        children = dict()
+        for row in self.db.execute(
+            "SELECT * FROM nodes WHERE dataset = ? ORDER BY parent, position",
+            (ds_name,)
+        ):
+            children.setdefault(row['parent'], []).append(row)
+
+        stack = [(0, x) for x in reversed(children.get(ds_row['id'], []))]
+        while stack:
+            depth, row = stack.pop()
+            yield depth, row
+            stack.extend(
+                (depth + 1, x) for x in reversed(children.get(row['id'], []))
+            )
+
+    def get_tree(self, ds_name):
+        """
+        Return a fully listed DatasetTree of dataset `ds_name` whose nodes
+        are `IndexedObject`s, or None if the dataset is not indexed.
+        """
+
+        ds_row = self.get_dataset(ds_name)
+        if ds_row is None:
+            return None
+
+        root = IndexedObject({
+            'id': ds_row['id'],
+            'name': ds_name,
+            'is_collection': True,
+            'real_name': None,
+            'size': None,
+            'updated_at': ds_row['updated_at'],
+        })
+        tree = DatasetTree(root)
+
+        parents = [tree.root]
+        tree.root.children = list()
+        for depth, row in self.walk(ds_name):
+            del parents[depth + 1:]
+            node = tree._add_node(IndexedObject(row), parents[depth])
+            node.children = list()
+            parents.append(node)
+
+        return tree
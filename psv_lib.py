@@ -1,16 +1,160 @@
 """Library for Pennsieve utility scripts."""
 
+import atexit
+import bisect
+import calendar
+import fnmatch
+import functools
 import getopt
+import io
+import json
+import math
 import os
+import random
+import re
 import sys
-
-from pennsieve import Pennsieve
+import threading
+import time
+import traceback
+from collections import namedtuple
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
 
 # Extensions that Pennsieve doesn't know
 EXTENSIONS = ['ome.tiff', 'fastq.gz', 'bigWig', 'bw', 'metadata']
 
+# Matcher of EXTENSIONS at the end of a file name (see `get_file_name()`),
+# which matches the beginning of the reversed name so that only the
+# suffix is scanned, and the spelling of each (reversed) extension
+EXTENSION_RE = re.compile(
+    '|'.join(
+        re.escape(x[::-1]) for x in sorted(EXTENSIONS, key=len, reverse=True)
+    ),
+    re.IGNORECASE
+)
+EXTENSION_CASE = {x[::-1].lower(): x for x in EXTENSIONS}
+
+# `updatedAt` timestamp of Pennsieve (in UTC), such as
+# '2020-01-01T00:00:00.000000Z' (see `parse_timestamp()`)
+TIMESTAMP_RE = re.compile(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?')
+
+# Local cache of the dataset catalog, and the number of seconds it is
+# trusted before being revalidated against Pennsieve server (the catalog
+# of a fake server is cached separately, see `psv_fake.py`)
+CATALOG_FILE = os.path.expanduser(
+    os.environ.get(
+        'PSV_CATALOG_FILE',
+        '~/.pennsieve/psv_catalog_fake.json' if os.environ.get('PSV_FAKE')
+        else '~/.pennsieve/psv_catalog.json'
+    )
+)
+CATALOG_TTL = int(os.environ.get('PSV_CATALOG_TTL', 3600))
+
+# Unix socket of `psv-daemon.py` (a fake server has its own daemon); scripts
+# don't use the daemon if environment variable PSV_DAEMON is '0'
+DAEMON_SOCKET = os.path.expanduser(
+    os.environ.get(
+        'PSV_DAEMON_SOCKET',
+        '~/.pennsieve/psv_daemon_fake.sock' if os.environ.get('PSV_FAKE')
+        else '~/.pennsieve/psv_daemon.sock'
+    )
+)
+
+# Maximum number of concurrent requests (see `AdaptiveLimiter`)
+MAX_WORKERS = int(os.environ.get('PSV_MAX_WORKERS', 16))
+
+# HTTP status codes that mean Pennsieve server is throttling requests
+THROTTLE_STATUS = [429, 503]
+
+# Retry policy of idempotent requests (see `call_with_retry()`): maximum
+# number of attempts of each request, maximum number of retries of a run,
+# and the base and cap of exponential backoff (in seconds)
+RETRY_ATTEMPTS = int(os.environ.get('PSV_RETRY_ATTEMPTS', 5))
+RETRY_BUDGET = int(os.environ.get('PSV_RETRY_BUDGET', 200))
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_CAP = 30.0
+
+# Options that are accepted by all scripts (see `parse_options()`)
+GLOBAL_LONG_OPTS = [
+    'refresh-catalog', 'pool-stats', 'profile', 'trace=', 'jobs=', 'select='
+]
+
+# Global options whose reports are printed when a script exits, so scripts
+# that use them are never sent to `psv-daemon.py`
+LOCAL_OPTS = ['--pool-stats', '--profile', '--trace']
+
+# Number of datasets processed concurrently by `run_datasets()`, which is
+# set by `--jobs` option
+JOBS = 1
+
+# Dataset selection expression of `--select` option (see `select_datasets()`)
+SELECTION = None
+
+# Pennsieve client, created by `get_client()` the first time it is needed
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Return the global Pennsieve client.  The client (and the login that
+    comes with it) is created on the first call, so that scripts which
+    only print help or validate options never touch the network.  If
+    environment variable PSV_FAKE is set, it's a fake client (see
+    `psv_fake.py`) that never touches the network.
+    """
+
+    global _client
+
+    if _client is not None:
+        return _client
+
+    with _client_lock:
+        if _client is None and os.environ.get('PSV_FAKE'):
+            from psv_fake import get_fake_client
+
+            _client = get_fake_client(os.environ['PSV_FAKE'])
+
+        if _client is None:
+            from pennsieve import Pennsieve
+            from psv_http import configure_session, get_client_session
+
+            client = Pennsieve()
+
+            # One connection per worker, reused by all requests of the script
+            session = get_client_session(client)
+            if session is not None:
+                configure_session(session, MAX_WORKERS)
+
+            _client = client
+
+        return _client
+
+
+def print_pool_stats():
+    """Print statistics of HTTP connection pools (if any)."""
+
+    if 'psv_http' in sys.modules:
+        print(sys.modules['psv_http'].POOL_STATS.report())
+
+
+class LazyClient:
+    """Proxy of the global Pennsieve client that is created on first use."""
+
+    def __getattr__(self, name):
+        return getattr(get_client(), name)
+
+    def __repr__(self):
+        if _client is None:
+            return "<LazyClient (not connected)>"
+
+        return repr(_client)
+
+
 # Global Pennsieve client instance
-psv = Pennsieve()
+psv = LazyClient()
 
 
 def get_datasets():
@@ -37,8 +181,301 @@ def get_datasets():
     return ds_dict
 
 
+def get_catalog_fingerprint():
+    """
+    Return a cheap fingerprint of the dataset catalog on Pennsieve server:
+    the number of datasets and the latest `updatedAt` among them, which
+    only requires one dataset in the response.  Return None if it can
+    not be retrieved.
+    """
+
+    try:
+        resp = psv._api._get(
+            '/datasets/paginated',
+            params={
+                'limit': 1,
+                'offset': 0,
+                'orderBy': 'UpdatedAt',
+                'orderDirection': 'Desc',
+            },
+        )
+        datasets = resp.get('datasets', [])
+        updated_at = datasets[0]['content']['updatedAt'] if datasets else None
+        return [resp['totalCount'], updated_at]
+    except Exception:
+        return None
+
+
+def read_catalog_cache():
+    """Return the content of CATALOG_FILE, or None if it's not valid."""
+
+    try:
+        with open(CATALOG_FILE) as fd:
+            cache = json.load(fd)
+
+        if isinstance(cache['datasets'], dict):
+            return cache
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    return None
+
+
+def write_catalog_cache(ds_dict, fingerprint):
+    """Save `ds_dict` and `fingerprint` into CATALOG_FILE."""
+
+    cache = {
+        'fetched_at': time.time(),
+        'fingerprint': fingerprint,
+        'datasets': ds_dict,
+    }
+
+    # Write to a temporary file first so that concurrent scripts never
+    # read a partially written cache.
+    tmp_file = f"{CATALOG_FILE}.{os.getpid()}"
+    try:
+        os.makedirs(os.path.dirname(CATALOG_FILE), exist_ok=True)
+        with open(tmp_file, 'w') as fd:
+            json.dump(cache, fd)
+
+        os.replace(tmp_file, CATALOG_FILE)
+    except OSError as e:
+        print(f"WARNING: failed to write dataset catalog cache: {e}")
+
+
+def load_catalog(refresh=False):
+    """
+    Return the dataset catalog (see `get_datasets()`) from CATALOG_FILE.
+
+    The catalog is fetched from Pennsieve server if the cache doesn't
+    exist or `refresh` is True.  A cache that is older than CATALOG_TTL
+    seconds is revalidated by `get_catalog_fingerprint()`, and fetched
+    again only if the fingerprint has changed.
+    """
+
+    cache = None if refresh else read_catalog_cache()
+
+    if cache is not None:
+        if time.time() - cache.get('fetched_at', 0) < CATALOG_TTL:
+            return cache['datasets']
+
+        fingerprint = get_catalog_fingerprint()
+        if fingerprint is not None and fingerprint == cache.get('fingerprint'):
+            write_catalog_cache(cache['datasets'], fingerprint)
+            return cache['datasets']
+    else:
+        fingerprint = get_catalog_fingerprint()
+
+    ds_dict = get_datasets()
+    write_catalog_cache(ds_dict, fingerprint)
+
+    return ds_dict
+
+
+class LazyDatasets(Mapping):
+    """
+    Read-only dict of the dataset catalog that is loaded by `load_catalog()`
+    the first time a dataset is looked up.
+    """
+
+    def __init__(self):
+        self._ds_dict = None
+        self._refresh = False   # whether the catalog is reloaded from server
+        self._fresh = False     # whether the catalog came from server
+        self._sorted = None     # (catalog, its sorted keys)
+        self._lock = threading.Lock()
+
+    def _load(self):
+        ds_dict = self._ds_dict
+        if ds_dict is not None:
+            return ds_dict
+
+        with self._lock:
+            if self._ds_dict is None:
+                self._ds_dict = load_catalog(refresh=self._refresh)
+                self._fresh, self._refresh = self._refresh, False
+
+            return self._ds_dict
+
+    def sorted_keys(self):
+        """Return a sorted list of short names of all datasets."""
+
+        ds_dict = self._load()
+        if self._sorted is None or self._sorted[0] is not ds_dict:
+            self._sorted = (ds_dict, sorted(ds_dict))
+
+        return self._sorted[1]
+
+    def reload(self):
+        """
+        Load the catalog again by `load_catalog()` on next lookup, from the
+        cache if it's still valid (even if `refresh()` was called before).
+        """
+
+        self._ds_dict = None
+        self._refresh = False
+
+    def refresh(self):
+        """Reload the catalog from Pennsieve server on next lookup."""
+
+        self._ds_dict = None
+        self._refresh = True
+
+    def __getitem__(self, key):
+        ds_dict = self._load()
+
+        # A dataset that is not in the cached catalog may have been created
+        # after the cache was written, so reload the catalog once.
+        if key not in ds_dict and not self._fresh:
+            self.refresh()
+            ds_dict = self._load()
+
+        return ds_dict[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+
 # All datasets on Pennsieve
-psv_datasets = get_datasets()
+psv_datasets = LazyDatasets()
+
+
+# Matcher of the parts of a selection expression between commas, which
+# don't split a regular expression between slashes
+SELECTION_PART_RE = re.compile(r'(?:/(?:[^/\\]|\\.)*/|[^,])+')
+
+# Matcher of the terms in a part of a selection expression, which are
+# separated by whitespace characters
+SELECTION_TERM_RE = re.compile(r'!?/(?:[^/\\]|\\.)*/|[^,\s]+')
+
+
+def is_dataset_name(name, keys):
+    """Test whether `name` is in sorted list `keys` of dataset short names."""
+
+    i = bisect.bisect_left(keys, name)
+    return i < len(keys) and keys[i] == name
+
+
+def split_selection(expr):
+    """
+    Split selection expression `expr` into terms (see `select_datasets()`).
+    Dataset names are taken literally: if `expr`, or a part of it between
+    commas, is the exact name of a dataset (optionally after '!'), it's a
+    single term, even if it has whitespace, '..', '[', '*' or '/' in it.
+    """
+
+    keys = psv_datasets.sorted_keys()
+
+    def is_literal(term):
+        return is_dataset_name(term[1:] if term[:1] == '!' else term, keys)
+
+    if is_literal(expr):
+        return [expr]
+
+    terms = list()
+    for part in SELECTION_PART_RE.findall(expr):
+        if is_literal(part.strip()):
+            terms.append(part.strip())
+        else:
+            terms.extend(SELECTION_TERM_RE.findall(part))
+
+    return terms
+
+
+def match_datasets(term, keys):
+    """
+    Return a list of dataset short names in sorted `keys` that match a
+    (non-exclusion) selection term.  Ranges and the literal prefix of globs
+    are looked up by bisection, so they only visit matching keys.  A term
+    that is the exact name of a dataset only matches that dataset.
+    """
+
+    if is_dataset_name(term, keys):
+        return [term]
+
+    if len(term) > 1 and term.startswith('/') and term.endswith('/'):
+        try:
+            regex = re.compile(term[1:-1])
+        except re.error as e:
+            print(f"ERROR: invalid regular expression '{term}': {e}")
+            sys.exit(1)
+
+        return [k for k in keys if regex.search(k)]
+
+    if '..' in term:
+        first, last = term.split('..', 1)
+        if first > last:
+            print(f"ERROR: invalid range '{term}'")
+            sys.exit(1)
+
+        start = bisect.bisect_left(keys, first)
+        stop = bisect.bisect_right(keys, last)
+        return keys[start:stop]
+
+    if any(c in term for c in '*?['):
+        prefix = re.split(r'[*?\[]', term, maxsplit=1)[0]
+        matched = list()
+        for k in keys[bisect.bisect_left(keys, prefix):]:
+            if not k.startswith(prefix):
+                break
+            if fnmatch.fnmatchcase(k, term):
+                matched.append(k)
+
+        return matched
+
+    if term not in psv_datasets:
+        print(f"ERROR: dataset '{term}' not exist on Pennsieve")
+        sys.exit(1)
+
+    return [term]
+
+
+def select_datasets(terms):
+    """
+    Return a sorted list of dataset short names selected by `terms`, each
+    of which is one of:
+      * a dataset short name, such as 'HPAP-001';
+      * a glob, such as 'HPAP-0[0-4]*';
+      * an inclusive range in sorted order, such as 'HPAP-001..HPAP-050';
+      * a regular expression between slashes, such as '/^HPAP-00[1-9]$/'.
+    A term that starts with '!' excludes its datasets from the terms before
+    it; if the first term is an exclusion, it excludes them from all HPAP
+    datasets.
+    """
+
+    keys = psv_datasets.sorted_keys()
+
+    selected = set()
+    if terms and terms[0].startswith('!'):
+        selected.update(k for k in keys if k.startswith('HPAP-'))
+
+    for term in terms:
+        if term.startswith('!'):
+            selected.difference_update(match_datasets(term[1:], keys))
+        else:
+            selected.update(match_datasets(term, keys))
+
+    return sorted(selected)
+
+
+def get_all_keys():
+    """
+    Return a sorted list of short names of datasets that are processed by
+    `--all` option: all HPAP datasets, or those selected by `--select`.
+    """
+
+    if SELECTION is None:
+        return [k for k in psv_datasets.sorted_keys() if k.startswith('HPAP-')]
+
+    keys = select_datasets(split_selection(SELECTION))
+    if not keys:
+        print(f"ERROR: no dataset selected by '{SELECTION}'")
+        sys.exit(1)
+
+    return keys
 
 
 def collection_exists(col_name, dataset):
@@ -53,21 +490,903 @@ def collection_exists(col_name, dataset):
     return False
 
 
-def parse_options(args, short_opts, long_opts, syntax):
+def is_collection(item):
+    """Test whether a Pennsieve object `item` is a collection."""
+
+    return getattr(item, 'type', None) == 'Collection'
+
+
+def join_path(*parts):
+    """Join non-empty `parts` into a dataset path without leading '/'."""
+
+    return '/'.join(x for p in parts for x in p.split('/') if x)
+
+
+class TreeNode:
+    """A collection or a package in `DatasetTree`."""
+
+    __slots__ = ('obj', 'path', 'parent', 'children')
+
+    def __init__(self, obj, path, parent):
+        self.obj = obj            # Pennsieve object
+        self.path = path          # path in dataset ('' for the dataset itself)
+        self.parent = parent      # parent TreeNode (None for the dataset)
+        self.children = None      # list of child TreeNodes, None if not listed
+
+    @property
+    def name(self):
+        return self.obj.name
+
+    @property
+    def id(self):
+        return self.obj.id
+
+    @property
+    def is_collection(self):
+        return self.parent is None or is_collection(self.obj)
+
+
+class DatasetTree:
+    """
+    Snapshot of a dataset's hierarchy.  Each collection is listed at most
+    once (when it is first needed, or all at once by `load()`), and its
+    children are indexed by both path and id, so that repeated lookups
+    don't send any more requests to Pennsieve server.
+    """
+
+    def __init__(self, dataset):
+        self.root = TreeNode(dataset, '', None)
+        self.by_path = {'': self.root}
+        self.by_id = {dataset.id: self.root}
+
+    @property
+    def dataset(self):
+        return self.root.obj
+
+    def _add_node(self, obj, parent):
+        node = TreeNode(obj, join_path(parent.path, obj.name), parent)
+        parent.children.append(node)
+        self.by_id[obj.id] = node
+
+        # If names are duplicated, the first one wins, which is consistent
+        # with `get_items_by_name(name)[0]` in Pennsieve client.
+        self.by_path.setdefault(node.path, node)
+
+        return node
+
+    def children(self, node):
+        """Return child nodes of `node`, listing them if necessary."""
+
+        if node.children is None:
+            node.children = list()
+            if node.is_collection:
+                for item in list_items(node.obj):
+                    self._add_node(item, node)
+
+        return node.children
+
+    def load(self):
+        """List all collections in the dataset."""
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            stack.extend(x for x in self.children(node) if x.is_collection)
+
+        return self
+
+    def get_node(self, path):
+        """Return the node at `path`, or None if it doesn't exist."""
+
+        path = join_path(path)
+        node = self.by_path.get(path)
+        if node is not None:
+            return node
+
+        node = self.root
+        for d in path.split('/'):
+            self.children(node)
+            node = self.by_path.get(join_path(node.path, d))
+            if node is None:
+                return None
+
+        return node
+
+    def get(self, path):
+        """Return the Pennsieve object at `path`, or None if not exist."""
+
+        node = self.get_node(path)
+        return node.obj if node else None
+
+    def add(self, parent_path, obj):
+        """Add `obj` that was just created in `parent_path` to the tree."""
+
+        parent = self.get_node(parent_path)
+        if parent is not None and parent.children is not None:
+            self._add_node(obj, parent)
+
+    def remove(self, path):
+        """Remove the node at `path` (and all its descendants) from the tree."""
+
+        node = self.get_node(path)
+        if node is None or node.parent is None:
+            return
+
+        node.parent.children.remove(node)
+        stack = [node]
+        while stack:
+            x = stack.pop()
+            self.by_id.pop(x.id, None)
+            if self.by_path.get(x.path) is x:
+                del self.by_path[x.path]
+            stack.extend(x.children or [])
+
+        # Expose the next node with the same name (if any).
+        for x in node.parent.children:
+            if x.path == node.path:
+                self.by_path[x.path] = x
+                break
+
+
+# DatasetTree snapshots that have been created, keyed by dataset's long name,
+# and the time when each of them was created
+_trees = dict()
+_tree_times = dict()
+_trees_lock = threading.Lock()
+
+
+def get_tree(ds_name):
+    """Return the DatasetTree of dataset whose long name is `ds_name`."""
+
+    tree = _trees.get(ds_name)
+    if tree is not None:
+        return tree
+
+    # The dataset is fetched without the lock, so that other datasets don't
+    # wait for it; if two threads fetch it, both get the first tree.
+    tree = DatasetTree(get_dataset(ds_name))
+    with _trees_lock:
+        if ds_name not in _trees:
+            _trees[ds_name] = tree
+            _tree_times[ds_name] = time.time()
+
+        return _trees[ds_name]
+
+
+def forget_trees(max_age=0):
+    """
+    Forget DatasetTree snapshots that were created more than `max_age`
+    seconds ago, and return the number of snapshots that are kept.
+    """
+
+    now = time.time()
+    with _trees_lock:
+        for ds_name, created_at in list(_tree_times.items()):
+            if now - created_at >= max_age:
+                _trees.pop(ds_name, None)
+                del _tree_times[ds_name]
+
+        return len(_trees)
+
+
+class PathNode:
+    """
+    A collection or package gathered from a dataset by `get_collections()`
+    of psv-sync.py and psv-compare.py.  A node only keeps its own name and
+    a reference to its parent (which is shared by its siblings), and its
+    path is built when it's needed.
+    """
+
+    __slots__ = ('parent', 'name', 'id')
+
+    def __init__(self, parent, name, pkg_id=None):
+        self.parent = parent  # parent PathNode (None for top-level nodes)
+        self.name = name      # collection name, or local file name of package
+        self.id = pkg_id      # package id (None for collections)
+
+    def __repr__(self):
+        return f"<PathNode '{self.path}'>"
+
+    @property
+    def is_package(self):
+        return self.id is not None
+
+    @property
+    def path(self):
+        if self.parent is None:
+            return self.name
+
+        return f"{self.parent.path}/{self.name}"
+
+
+def add_path_node(parents, depth, name, pkg_id=None):
+    """
+    Return a new PathNode that is at `depth` of a depth-first walk (such
+    as `PsvIndex.walk()`).  `parents` is the list of current ancestors,
+    which starts as [top_node] (or [None]); it's updated so that a new
+    collection is the parent of the following nodes at `depth + 1`.
+    """
+
+    node = PathNode(parents[depth], name, pkg_id)
+    if pkg_id is None:
+        del parents[depth + 1:]
+        parents.append(node)
+
+    return node
+
+
+def is_throttled(error):
+    """Test whether exception `error` means that requests are throttled."""
+
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) in THROTTLE_STATUS:
+        return True
+
+    # `requests` raises RetryError when urllib3 gives up retrying 5xx errors
+    return type(error).__name__ == 'RetryError'
+
+
+class AdaptiveLimiter:
+    """
+    Limit the number of concurrent requests to Pennsieve server by a
+    window that is adjusted by AIMD (additive increase, multiplicative
+    decrease): the window grows by 1 after a window's worth of successful
+    requests whose latency stays below `latency_factor` times the best
+    latency seen so far, and is multiplied by `decrease` when requests are
+    throttled (at most once per round trip).
+    """
+
+    def __init__(
+        self, initial=4, minimum=1, maximum=MAX_WORKERS,
+        decrease=0.5, latency_factor=2.0
+    ):
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+
+        self.window = float(min(max(initial, minimum), self.maximum))
+        self.in_flight = 0
+        self.throttled = 0
+
+        self._cond = threading.Condition()
+        self._best_latency = None
+        self._last_decrease = 0.0
+
+    @property
+    def limit(self):
+        """Current number of requests that are allowed to be in flight."""
+
+        return int(self.window)
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+
+            self.in_flight += 1
+
+    def try_acquire(self):
+        """Take a slot if one is free in the window, and return True if so."""
+
+        with self._cond:
+            if self.in_flight >= self.limit:
+                return False
+
+            self.in_flight += 1
+            return True
+
+    def release(self, latency, throttled=False, failed=False):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.perf_counter()
+
+            if throttled:
+                self.throttled += 1
+                if now - self._last_decrease > latency:
+                    self.window = max(self.minimum, self.window * self.decrease)
+                    self._last_decrease = now
+            elif not failed:
+                if self._best_latency is None or latency < self._best_latency:
+                    self._best_latency = latency
+
+                if latency <= self._best_latency * self.latency_factor:
+                    self.window = min(
+                        self.maximum, self.window + 1 / self.window
+                    )
+
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Context manager that runs its body (a request) within the window."""
+
+        self.acquire()
+        start_time = time.perf_counter()
+        throttled = failed = False
+        try:
+            yield
+        except Exception as e:
+            throttled = is_throttled(e)
+            failed = True
+            raise
+        finally:
+            self.release(time.perf_counter() - start_time, throttled, failed)
+
+    def status(self):
+        """Return current status as a string for progress output."""
+
+        return (
+            f"concurrency {self.limit}/{self.maximum}, "
+            f"{self.throttled} throttled"
+        )
+
+
+# Limiter that is shared by all concurrent requests of a script
+LIMITER = AdaptiveLimiter()
+
+# Thread pool of `map_limited()`, created the first time it is needed
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def map_limited(func, items):
+    """
+    Return a list of `func(x)` for each `x` in `items` (in the same order),
+    which are called concurrently within the window of LIMITER.
+    """
+
+    global _pool
+
+    def limited_func(x):
+        with LIMITER.slot():
+            return func(x)
+
+    items = list(items)
+    if len(items) <= 1:
+        return [limited_func(x) for x in items]
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=LIMITER.maximum,
+                    thread_name_prefix='psv-worker',
+                )
+
+    return list(_pool.map(limited_func, items))
+
+
+def is_retriable(error):
+    """Test whether exception `error` is transient, so that it can be retried."""
+
+    from requests.exceptions import ConnectionError, Timeout
+
+    if isinstance(error, (ConnectionError, Timeout)) or is_throttled(error):
+        return True
+
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', 0) >= 500
+
+
+class RetryStats:
+    """Thread-safe counters of retries, which are printed at exit."""
+
+    def __init__(self, budget):
+        self._lock = threading.Lock()
+        self.budget = budget
+        self.retries = 0
+        self.backoff_time = 0.0
+        self.given_up = 0
+        self._registered = False
+
+    def reset(self):
+        """Restore the budget (for a new run in the same process)."""
+
+        with self._lock:
+            self.retries = 0
+            self.backoff_time = 0.0
+            self.given_up = 0
+
+    def take(self, delay):
+        """Take a retry (which will sleep `delay` seconds) from the budget."""
+
+        with self._lock:
+            if self.retries >= self.budget:
+                self.given_up += 1
+                return False
+
+            if not self._registered:
+                atexit.register(self.report)
+                self._registered = True
+
+            self.retries += 1
+            self.backoff_time += delay
+            return True
+
+    def report(self):
+        print(
+            f"\nRetries: {self.retries} ({self.backoff_time:.2f} seconds "
+            f"of backoff), {self.given_up} not retried due to retry budget"
+        )
+
+
+# Retries of all requests in a run
+RETRY_STATS = RetryStats(RETRY_BUDGET)
+
+
+def get_endpoint_name(method, url):
+    """
+    Return the name of Pennsieve API endpoint of a request, which is its
+    method and URL path with ids replaced by '{id}', such as
+    'GET /packages/{id}/sources'.
+    """
+
+    parts = urlsplit(url).path.split('/')
+    for i, part in enumerate(parts):
+        if part.startswith('N:') or part.isdigit():
+            parts[i] = '{id}'
+
+    return f"{method} {'/'.join(parts)}"
+
+
+class CallProfile:
+    """
+    Thread-safe counters and latency histograms of Pennsieve calls per
+    endpoint, which are printed at exit by `--profile` option.  Nothing is
+    recorded unless `enabled` is True.
+
+    Histograms have logarithmic buckets (each one is 9% wider than the
+    previous one), so percentiles are accurate within 9%, and memory does
+    not grow with the number of calls.
+    """
+
+    BUCKET_BASE = 2 ** 0.125
+    BUCKET_MIN = 0.0001  # in seconds
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enabled = False
+        self.endpoints = dict()
+
+    def record(self, name, seconds, nbytes=0, failed=False):
+        """Record a call of endpoint `name` that took `seconds`."""
+
+        bucket = int(
+            math.log(max(seconds, self.BUCKET_MIN) / self.BUCKET_MIN,
+                     self.BUCKET_BASE)
+        )
+
+        with self._lock:
+            stats = self.endpoints.get(name)
+            if stats is None:
+                stats = self.endpoints[name] = {
+                    'calls': 0, 'failed': 0, 'time': 0.0, 'max': 0.0,
+                    'bytes': 0, 'histogram': dict(),
+                }
+
+            stats['calls'] += 1
+            stats['failed'] += failed
+            stats['time'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['bytes'] += nbytes
+            stats['histogram'][bucket] = stats['histogram'].get(bucket, 0) + 1
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Context manager that records a call of endpoint `name`, which is
+        not a request of Pennsieve client's session (such as a download
+        from S3).  The number of bytes can be set in the yielded dict.
+        """
+
+        call = {'bytes': 0}
+        start_time = time.perf_counter()
+        try:
+            yield call
+        except Exception:
+            if self.enabled:
+                self.record(name, time.perf_counter() - start_time, failed=True)
+            raise
+
+        if self.enabled:
+            self.record(name, time.perf_counter() - start_time, call['bytes'])
+
+    def percentile(self, stats, p):
+        """Return `p`-th percentile (in seconds) of an endpoint's calls."""
+
+        rank = math.ceil(stats['calls'] * p / 100)
+        count = 0
+        for bucket in sorted(stats['histogram']):
+            count += stats['histogram'][bucket]
+            if count >= rank:
+                upper = self.BUCKET_MIN * self.BUCKET_BASE ** (bucket + 1)
+                return min(upper, stats['max'])
+
+        return stats['max']
+
+    def report(self):
+        """Print a table of all endpoints, slowest first."""
+
+        print(
+            f"\n{'endpoint':<40} {'calls':>7} {'failed':>6} {'total (s)':>10} "
+            f"{'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'bytes':>13}"
+        )
+        print('-' * 108)
+
+        endpoints = sorted(
+            self.endpoints.items(), key=lambda x: x[1]['time'], reverse=True
+        )
+        for name, stats in endpoints:
+            p50, p95, p99 = (
+                self.percentile(stats, p) * 1000 for p in [50, 95, 99]
+            )
+            print(
+                f"{name:<40} {stats['calls']:>7} {stats['failed']:>6} "
+                f"{stats['time']:>10.2f} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f} "
+                f"{stats['bytes']:>13,}"
+            )
+
+
+# Pennsieve calls of a run (see `--profile` option)
+PROFILE = CallProfile()
+
+
+class TraceSink:
+    """
+    Writer of spans (timed steps of a run, such as a collection listing or
+    a download) to a trace file (see `--trace` option).  The file is in
+    Chrome trace-event format (a JSON array that can be loaded by Perfetto
+    or chrome://tracing), or NDJSON (one event per line) if its name ends
+    with '.ndjson'.  Spans are written as soon as they end, so the trace
+    of an interrupted run can still be loaded.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fd = None
+        self._ndjson = False
+        self._events = 0
+        self._threads = set()
+        self._start_time = time.perf_counter()
+
+    @property
+    def enabled(self):
+        return self._fd is not None
+
+    def open(self, filename):
+        """Start writing spans to `filename`."""
+
+        try:
+            self._fd = open(filename, 'w')
+        except OSError as e:
+            print(f"ERROR: failed to open trace file: {e}")
+            sys.exit(1)
+
+        self._ndjson = filename.endswith('.ndjson')
+        if not self._ndjson:
+            self._fd.write('[\n')
+
+        atexit.register(self.close)
+
+    def close(self):
+        with self._lock:
+            if self._fd is None:
+                return
+
+            if not self._ndjson:
+                self._fd.write('\n]\n')
+
+            self._fd.close()
+            self._fd = None
+
+    def _write_event(self, event):
+        if self._ndjson:
+            self._fd.write(json.dumps(event) + '\n')
+        else:
+            self._fd.write((',\n' if self._events else '') + json.dumps(event))
+
+        self._events += 1
+
+    def write(self, name, category, start_time, duration, args):
+        """Write a span that started at `start_time` (by perf_counter)."""
+
+        pid, tid = os.getpid(), threading.get_native_id()
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start_time - self._start_time) * 1e6),
+            'dur': round(duration * 1e6),
+            'pid': pid,
+            'tid': tid,
+            'args': args,
+        }
+
+        with self._lock:
+            if self._fd is None:
+                return
+
+            # Name the thread on its first span
+            if tid not in self._threads:
+                self._threads.add(tid)
+                self._write_event({
+                    'name': 'thread_name',
+                    'ph': 'M',
+                    'pid': pid,
+                    'tid': tid,
+                    'args': {'name': threading.current_thread().name},
+                })
+
+            self._write_event(event)
+
+    @contextmanager
+    def span(self, name, category, **args):
+        """Context manager that writes a span of its body (if enabled)."""
+
+        if self._fd is None:
+            yield
+            return
+
+        start_time = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            args['error'] = str(e)
+            raise
+        finally:
+            self.write(
+                name, category, start_time,
+                time.perf_counter() - start_time, args
+            )
+
+
+# Trace of a run (see `--trace` option)
+TRACE = TraceSink()
+
+
+def call_with_retry(func, *args, **kwargs):
+    """
+    Return `func(*args, **kwargs)`, which must be idempotent.  If it
+    raises a transient error (see `is_retriable()`), it is retried up to
+    RETRY_ATTEMPTS times in total, with capped exponential backoff and
+    full jitter, as long as the retry budget of the run is not used up.
+    """
+
+    attempt = 1
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt >= RETRY_ATTEMPTS or not is_retriable(e):
+                raise
+
+            cap = min(RETRY_BACKOFF_CAP, RETRY_BACKOFF * 2 ** (attempt - 1))
+            delay = random.uniform(0, cap)
+            if not RETRY_STATS.take(delay):
+                raise
+
+            time.sleep(delay)
+            attempt += 1
+
+
+def get_dataset(ds_name):
+    """Return Pennsieve dataset whose long name is `ds_name`."""
+
+    with TRACE.span('get_dataset', 'dataset', dataset=ds_name):
+        return call_with_retry(psv.get_dataset, ds_name)
+
+
+def list_items(obj):
+    """Return the items in a Pennsieve dataset or collection `obj`."""
+
+    with TRACE.span('list_items', 'collection', collection=obj.name, id=obj.id):
+        return call_with_retry(lambda: obj.items)
+
+
+# Package's name and its first source file, returned by `resolve_package()`.
+# `real_name` is the name of the source file on S3, which (along with
+# `source`) is None if it's not available; `updated_at` is the `updatedAt`
+# timestamp of the package (None if it's not known).  `error` is the
+# exception if the package could not be resolved (after retries), which is
+# not the same as a package without a source file, whose `error` is None.
+PackageInfo = namedtuple(
+    'PackageInfo',
+    ['id', 'name', 'real_name', 'size', 'source', 'updated_at', 'error'],
+    defaults=[None, None]
+)
+
+
+def resolve_package(item):
+    """
+    Return PackageInfo of `item`, which is a package, its id, or its
+    PackageInfo without a source (such as of the local index).  A package
+    that is listed in a collection already has its name, so only its
+    sources are requested; so is a PackageInfo, whose real name is kept.
+    If the package can not be resolved, its `error` is set (and its name
+    will be its id if it's not known).
+    """
+
+    pkg_id = item if isinstance(item, str) else item.id
+    with TRACE.span('resolve_package', 'package', id=pkg_id):
+        if isinstance(item, PackageInfo):
+            try:
+                sources = call_with_retry(psv._api.packages.get_sources, pkg_id)
+                source = sources[0]
+            except IndexError:
+                return item
+            except Exception as e:
+                return item._replace(error=e)
+
+            return item._replace(source=source, size=source.size)
+
+        if isinstance(item, str):
+            try:
+                item = call_with_retry(psv._api.packages.get, item)
+            except Exception as e:
+                return PackageInfo(item, item, None, None, None, error=e)
+
+        error = None
+        try:
+            source = call_with_retry(psv._api.packages.get_sources, item)[0]
+            real_name = str(source.s3_key.split('/')[-1])
+        except IndexError:
+            source, real_name = None, None
+        except Exception as e:
+            source, real_name, error = None, None, e
+
+    return PackageInfo(
+        item.id, item.name, real_name, getattr(source, 'size', None), source,
+        getattr(item, 'updated_at', None), error
+    )
+
+
+def resolve_packages(items):
+    """
+    Resolve packages in `items` (see `resolve_package()`) concurrently (see
+    `map_limited()`), and return a list of their PackageInfo in the same
+    order as `items`.
+    """
+
+    return map_limited(resolve_package, items)
+
+
+def parse_timestamp(value):
+    """
+    Return `updatedAt` timestamp `value` of Pennsieve as seconds since the
+    epoch, or None if it's not available.
+    """
+
+    match = TIMESTAMP_RE.match(str(value or ''))
+    if match is None:
+        return None
+
+    seconds = calendar.timegm(time.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S'))
+    return seconds + float(match.group(2) or 0)
+
+
+# Number of package file names cached by `get_file_name()`, which is
+# bounded so that a long-running daemon (see `psv_daemon.py`) doesn't keep
+# the name of every package it has ever seen
+FILE_NAME_CACHE_SIZE = 2 ** 16
+
+
+@functools.lru_cache(maxsize=FILE_NAME_CACHE_SIZE)
+def get_file_name(pkg_name, real_name):
+    """
+    Return local file name of a package based on its name `pkg_name` and
+    the real name `real_name` of its source file on S3: the extension of
+    `real_name` is appended to `pkg_name` if it's not there, and bigWig
+    files are saved as '.bw'.  Up to FILE_NAME_CACHE_SIZE recent names are
+    cached.
+    """
+
+    match = EXTENSION_RE.match(real_name[::-1])
+    if match:
+        real_ext = EXTENSION_CASE[match.group().lower()]
+    else:
+        real_ext = real_name.rsplit(".", 1)[-1]
+
+    if pkg_name[-len(real_ext):] == real_ext:
+        file_name = pkg_name
+    else:
+        file_name = pkg_name.replace(real_ext, "") + "." + real_ext
+
+    if file_name.endswith(".bigWig"):
+        file_name = file_name[:-len("bigWig")] + "bw"
+
+    return file_name
+
+
+def get_index_entries(dataset, index):
+    """
+    Yield a tuple of (depth, name, is_collection, PackageInfo) of each node
+    of `dataset` in local index `index` (see `walk_dataset()`).
+    """
+
+    for depth, row in index.walk(dataset.name):
+        if row['is_collection']:
+            yield depth, row['name'], True, None
+            continue
+
+        # A package that failed to be resolved is kept if it was indexed
+        error = None
+        if row['real_name'] is None:
+            error = index.failed.get(row['id'])
+
+        yield depth, row['name'], False, PackageInfo(
+            row['id'], row['name'], row['real_name'], row['size'], None,
+            row['updated_at'], error
+        )
+
+
+def walk_dataset(dataset, root=None, index=None, with_packages=True):
+    """
+    Yield a tuple of (PathNode, PackageInfo) of each collection and package
+    in `dataset` in depth-first order, based on local index `index` (see
+    `psv_index.py`), which is refreshed first if `dataset` has changed, or
+    if it's None, by crawling the whole dataset concurrently by `psv_async`.
+    `root` is the parent node of top-level nodes.
+
+    PackageInfo is None for collections; that of a package of the index has
+    no source yet (see `resolve_package()`).  A package is named after its
+    file, unless it failed to be resolved (see PackageInfo.error); packages
+    without a real name are ignored, and so are all packages if
+    `with_packages` is False.
+    """
+
+    if index is not None:
+        index.refresh(dataset)
+        entries = get_index_entries(dataset, index)
+    else:
+        from psv_async import crawl_dataset
+
+        entries = (
+            (depth, node.name, node.type == 'Collection', pkg)
+            for depth, node, pkg in crawl_dataset(dataset, with_packages)
+        )
+
+    parents = [root]
+    for depth, name, is_collection, pkg in entries:
+        if is_collection:
+            yield add_path_node(parents, depth, name), None
+        elif not with_packages:
+            continue
+        elif pkg.error is not None:
+            yield add_path_node(parents, depth, name, pkg.id), pkg
+        elif pkg.real_name is None:
+            print(
+                f"ERROR: unable to get real name of package: '{name}', ignored"
+            )
+        else:
+            file_name = get_file_name(pkg.name, pkg.real_name)
+            yield add_path_node(parents, depth, file_name, pkg.id), pkg
+
+
+def parse_options(
+    args, short_opts, long_opts, syntax, daemon=True, empty=False
+):
     """
     Parse input `args` based on `short_opts`, `long_opts`. If there's any
     error, or `-h` is in the options, print out `syntax_str` and exit;
     return a dict (key is option, value is the option's argument) otherwise.
+    There must be some options unless `empty` is True.
+
+    If `daemon` is True and `psv-daemon.py` is running, the command line
+    of the script is run by the daemon instead, and the script exits with
+    its status.
     """
 
-    if len(args) < 2:
+    if len(args) < 2 and not empty:
         print(syntax)
         sys.exit(1)
 
     argv = args[1:]
 
     try:
-        opts_list = getopt.getopt(argv, short_opts, long_opts)[0]
+        opts_list = getopt.getopt(
+            argv, short_opts, long_opts + GLOBAL_LONG_OPTS
+        )[0]
     except getopt.GetoptError:
         print("ERROR: invalid options")
         print(syntax)
@@ -80,6 +1399,48 @@ def parse_options(args, short_opts, long_opts, syntax):
         print(syntax)
         sys.exit()
 
+    if (
+        daemon and os.environ.get('PSV_DAEMON') != '0'
+        and os.path.exists(DAEMON_SOCKET)
+        and not any(x in opts_dict for x in LOCAL_OPTS)
+    ):
+        from psv_daemon import forward
+
+        status = forward(sys.argv)
+        if status is not None:
+            sys.exit(status)
+
+    # Global options
+    if '--refresh-catalog' in opts_dict:
+        psv_datasets.refresh()
+
+    if '--pool-stats' in opts_dict:
+        atexit.register(print_pool_stats)
+
+    if '--profile' in opts_dict:
+        PROFILE.enabled = True
+        atexit.register(PROFILE.report)
+
+    if '--trace' in opts_dict:
+        TRACE.open(opts_dict['--trace'])
+
+    # `--select` narrows down `--all` option
+    if '--select' in opts_dict:
+        global SELECTION
+        SELECTION = opts_dict['--select']
+        opts_dict.setdefault('--all', '')
+
+    if '--jobs' in opts_dict:
+        global JOBS
+        try:
+            JOBS = int(opts_dict['--jobs'])
+        except ValueError:
+            JOBS = 0
+
+        if JOBS < 1:
+            print("ERROR: argument of `--jobs` must be a positive integer")
+            sys.exit(1)
+
     return opts_dict
 
 
@@ -97,6 +1458,16 @@ def get_d_f_all_options(opts_dict):
     return d_opt, f_opt, all_opt
 
 
+def get_keys_in_file(filename):
+    """
+    Return a sorted list of dataset short names in `filename` (`-f` option),
+    one per line.  Lines are dataset names as they are, not terms of
+    `select_datasets()`, so that any dataset name can be listed.
+    """
+
+    return sorted(set(get_lines_in_file(filename)))
+
+
 def get_lines_in_file(filename):
     """Returna a list that includes all lines in `filename`."""
 
@@ -114,3 +1485,117 @@ def get_lines_in_file(filename):
             sys.exit(1)
 
     return lines
+
+
+class ThreadOutput:
+    """
+    Replacement of sys.stdout that sends what a thread prints to its own
+    buffer while the thread is in `capture()`, and everything else to the
+    original stream.  Captured output is still checked by `check_lost()`
+    of the stream if it has one (see ClientOutput of `psv_daemon.py`), so
+    that all threads stop once the client of psv-daemon has gone.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def _target(self):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            return self.stream
+
+        check_lost = getattr(self.stream, 'check_lost', None)
+        if check_lost:
+            check_lost()
+
+        return buffer
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    @contextmanager
+    def capture(self):
+        """Capture output of current thread in a StringIO, which is yielded."""
+
+        self._local.buffer = io.StringIO()
+        try:
+            yield self._local.buffer
+        finally:
+            self._local.buffer = None
+
+
+def run_dataset(func, ds_key):
+    """
+    Call `func(ds_key)`, and return its exit status: the code of
+    `sys.exit()` if it's called, 1 if an exception is raised, or 0.
+    """
+
+    try:
+        func(ds_key)
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+
+        print(e.code)
+        return 1
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+        print(f"ERROR: failed to process dataset '{ds_key}'")
+        return 1
+
+    return 0
+
+
+def run_datasets(func, ds_keys, jobs=None):
+    """
+    Call `func(ds_key)` for each dataset short name in `ds_keys`, in up to
+    `jobs` (JOBS by default) threads, and return the combined exit status,
+    which is the largest status of all datasets (see `run_dataset()`).
+    A dataset that fails doesn't stop the others.
+
+    When datasets are processed concurrently, the output of each dataset
+    is captured, and printed as a whole in the order of sorted `ds_keys`.
+    """
+
+    ds_keys = sorted(ds_keys)
+    jobs = jobs or JOBS
+
+    if jobs == 1 or len(ds_keys) <= 1:
+        return max((run_dataset(func, k) for k in ds_keys), default=0)
+
+    def run_captured(ds_key):
+        with output.capture() as buffer:
+            status = run_dataset(func, ds_key)
+
+        return status, buffer.getvalue()
+
+    output = ThreadOutput(sys.stdout)
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(jobs, thread_name_prefix='psv-job') as pool:
+            futures = [pool.submit(run_captured, k) for k in ds_keys]
+
+            statuses = list()
+            try:
+                for future in futures:
+                    status, text = future.result()
+                    output.stream.write(text)
+                    output.stream.flush()
+                    statuses.append(status)
+            except BaseException:
+                # Such as KeyboardInterrupt; datasets that haven't started
+                # are not started
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        sys.stdout = output.stream
+
+    return max(statuses)
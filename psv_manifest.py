@@ -0,0 +1,163 @@
+"""
+Local sync state of `psv-sync.py`.
+
+Each output directory has a SQLite manifest (MANIFEST_NAME) of the files
+that `psv-sync.py` has downloaded into it.  For every file, the manifest
+records its package (id, dataset and local file name), its source file on
+Pennsieve at the time it was downloaded (size, MD5 from the ETag of S3 if
+any, and `updatedAt` of the package), and the local file right after it
+was downloaded (path relative to the output directory, size and mtime).
+
+A package is unchanged if neither its source file nor its local file
+differs from its entry (see `is_unchanged()`), which costs a `stat()` of
+the local file, so quick sync knows what to download without walking the
+output directory, and a file that was deleted or modified locally is
+downloaded again.
+"""
+
+import os
+import sqlite3
+import time
+
+# Name of the manifest in an output directory
+MANIFEST_NAME = '.psv_sync.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    pkg_id TEXT PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    remote_size INTEGER,
+    checksum TEXT,
+    updated_at TEXT,
+    local_size INTEGER NOT NULL,
+    local_mtime REAL NOT NULL,
+    synced_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS files_dataset ON files (dataset);
+"""
+
+
+def get_updated_at(pkg_info):
+    """Return `updatedAt` of PackageInfo `pkg_info` as a string (or None)."""
+
+    if pkg_info.updated_at is None:
+        return None
+
+    return str(pkg_info.updated_at)
+
+
+def is_unchanged(entry, pkg_info, file_path):
+    """
+    Return True if neither the source file of package `pkg_info` nor its
+    local file `file_path` (an absolute path) has changed since manifest
+    `entry` was recorded.
+    """
+
+    if file_path != entry['path']:
+        return False
+
+    if pkg_info.size is not None and pkg_info.size != entry['remote_size']:
+        return False
+
+    if get_updated_at(pkg_info) != entry['updated_at']:
+        return False
+
+    try:
+        info = os.stat(file_path)
+    except OSError:
+        return False
+
+    return (
+        info.st_size == entry['local_size']
+        and info.st_mtime == entry['local_mtime']
+    )
+
+
+class SyncManifest:
+    """SQLite manifest of files downloaded into output directory `out_dir`."""
+
+    def __init__(self, out_dir):
+        self.out_dir = os.path.abspath(out_dir)
+        self.filename = os.path.join(self.out_dir, MANIFEST_NAME)
+
+        self.db = sqlite3.connect(self.filename)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def get_rel_path(self, path):
+        """Return `path` relative to the output directory."""
+
+        return os.path.relpath(os.path.abspath(path), self.out_dir)
+
+    def get_dataset(self, path):
+        """Return the dataset (short name) of local `path`."""
+
+        return self.get_rel_path(path).split(os.sep)[0]
+
+    def load(self, datasets=None):
+        """
+        Return a dict of entries of all files in `datasets` (all datasets
+        if it's None), whose keys are package ids; each entry has a key of
+        each column of the manifest, and its `path` is an absolute path.
+        """
+
+        if datasets is None:
+            rows = self.db.execute("SELECT * FROM files")
+        else:
+            datasets = list(datasets)
+            rows = self.db.execute(
+                "SELECT * FROM files WHERE dataset IN "
+                f"({', '.join('?' * len(datasets))})", datasets
+            )
+
+        entries = dict()
+        for row in rows:
+            entry = dict(row)
+            entry['path'] = os.path.join(self.out_dir, entry['path'])
+            entries[entry['pkg_id']] = entry
+
+        return entries
+
+    def record(self, pkg_info, file_path, checksum=None):
+        """
+        Record local file `file_path` of package `pkg_info`, which has just
+        been downloaded (or verified); `checksum` is its MD5 if it's known.
+        Changes are committed by `commit()`.
+        """
+
+        info = os.stat(file_path)
+        self.db.execute(
+            "INSERT OR REPLACE INTO files VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                pkg_info.id, self.get_dataset(file_path),
+                os.path.basename(file_path), self.get_rel_path(file_path),
+                pkg_info.size, checksum, get_updated_at(pkg_info),
+                info.st_size, info.st_mtime, time.time(),
+            )
+        )
+
+    def prune(self, datasets, pkg_ids):
+        """
+        Remove entries of files in `datasets` whose packages are not in
+        `pkg_ids` (which means they are no longer on Pennsieve), and return
+        the number of entries that are removed.
+        """
+
+        pkg_ids = set(pkg_ids)
+        stale = [
+            (x,) for x in self.load(datasets) if x not in pkg_ids
+        ]
+        self.db.executemany("DELETE FROM files WHERE pkg_id = ?", stale)
+
+        return len(stale)
+
+    def commit(self):
+        self.db.commit()
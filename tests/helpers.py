@@ -0,0 +1,43 @@
+"""Helpers of tests, which run scripts against the fake Pennsieve server."""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_fake(args, fake_spec, tmp_dir, **env):
+    """
+    Run script `args` in `tmp_dir` against a fake server of `fake_spec`
+    (without the daemon), with extra environment variables `env`, and
+    return a tuple of (CompletedProcess, seconds, fake stats).  State of
+    the script (catalog, index, etc.) is kept in `tmp_dir`.
+    """
+
+    stats_file = f"{tmp_dir}/stats.json"
+    env = dict(
+        os.environ,
+        HOME=tmp_dir,
+        PSV_FAKE=fake_spec,
+        PSV_FAKE_STATS=stats_file,
+        PSV_CATALOG_FILE=f"{tmp_dir}/catalog.json",
+        PSV_INDEX_FILE=f"{tmp_dir}/index.db",
+        PSV_DAEMON='0',
+        **env
+    )
+
+    start_time = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, f"{SCRIPT_DIR}/{args[0]}"] + args[1:],
+        cwd=tmp_dir,
+        env=env,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    seconds = time.perf_counter() - start_time
+
+    with open(stats_file) as fd:
+        return proc, seconds, json.load(fd)
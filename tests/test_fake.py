@@ -0,0 +1,40 @@
+"""Tests of the fake Pennsieve client (see `psv_fake.py`)."""
+
+import unittest
+import warnings
+
+from psv_fake import FakeClient
+
+
+class FakeCollectionTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient(donors=1, categories=1, subdirs=1, packages=1)
+        self.dataset = self.client.get_dataset("HPAP-001 fake donor")
+
+    def new_collection(self, name):
+        """Return a new collection of Pennsieve client, like psv-insert.py."""
+
+        from pennsieve.models import Collection
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            return Collection(name)
+
+    def test_list_collection_after_insert(self):
+        collection = self.new_collection("New")
+        self.dataset.add(collection)
+        self.assertTrue(collection.id)
+        self.assertEqual(collection.items, [])
+
+        # Collections can be inserted into an inserted collection, too
+        sub_collection = self.new_collection("Sub")
+        collection.add(sub_collection)
+        self.assertEqual([x.name for x in collection.items], ["Sub"])
+        self.assertEqual(sub_collection.items, [])
+
+        dataset = self.client.get_dataset("HPAP-001 fake donor")
+        self.assertIn(collection.id, [x.id for x in dataset.items])
+
+
+if __name__ == '__main__':
+    unittest.main()
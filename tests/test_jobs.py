@@ -0,0 +1,49 @@
+"""
+Tests of `--jobs` option against the fake Pennsieve server (see
+`psv_fake.py`).  Run them by `python -m unittest discover tests` (or pytest)
+in the top directory.
+"""
+
+import math
+import tempfile
+import unittest
+
+from helpers import run_fake
+
+# Seconds to start a script, on top of the time of its API calls
+STARTUP_TIME = 1.0
+
+
+class JobsTest(unittest.TestCase):
+    def test_tree_all_runs_jobs_datasets_at_once(self):
+        donors, categories, subdirs, latency, jobs = 24, 4, 2, 0.05, 8
+        fake_spec = (
+            f"donors={donors},categories={categories},subdirs={subdirs},"
+            f"packages=2,latency={latency}"
+        )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            proc, seconds, stats = run_fake(
+                ['psv-tree.py', '--all', '--jobs', str(jobs)],
+                fake_spec, tmp_dir
+            )
+
+        self.assertEqual(proc.returncode, 0)
+
+        # Without `--data`, the calls of a dataset are sent one by one, so
+        # each call in flight is a dataset in flight.
+        self.assertGreater(stats['max_in_flight'], 4)
+
+        # A dataset gets the dataset and lists each of its collections one
+        # by one; `jobs` datasets go at a time, after the catalog (2 calls).
+        collections = 1 + categories * (1 + subdirs)
+        dataset_time = (1 + collections) * latency
+        max_seconds = (
+            STARTUP_TIME + 2 * latency
+            + math.ceil(donors / jobs) * dataset_time
+        )
+        self.assertLess(seconds, max_seconds)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+Tests of `psv-sync.py` against the fake Pennsieve server (see
+`psv_fake.py`).
+"""
+
+import os
+import tempfile
+import unittest
+
+from helpers import run_fake
+
+FAKE_SPEC = "donors=1,categories=2,subdirs=1,packages=3"
+
+
+def get_files(root_dir):
+    """Return a sorted list of files under `root_dir`."""
+
+    return sorted(
+        os.path.join(dir_path, x)
+        for dir_path, _, file_names in os.walk(root_dir) for x in file_names
+    )
+
+
+class MirrorTest(unittest.TestCase):
+    def test_mirror_keeps_files_of_unresolved_packages(self):
+        # Packages that fail to be resolved are not retried
+        env = {'PSV_RETRY_ATTEMPTS': '1'}
+
+        for crawl_opts in [[], ['--index'], ['--async']]:
+            with self.subTest(crawl_opts=crawl_opts), \
+                    tempfile.TemporaryDirectory() as tmp_dir:
+                args = ['psv-sync.py', '-d', 'HPAP-001', '-o', 'out',
+                        '--mirror'] + crawl_opts
+                proc, _, _ = run_fake(args, FAKE_SPEC, tmp_dir, **env)
+                self.assertEqual(proc.returncode, 0, proc.stdout)
+
+                files = get_files(f"{tmp_dir}/out/HPAP-001")
+                self.assertEqual(len(files), 2 * 1 * 3)
+
+                # The 3rd package of each collection can't be resolved now
+                proc, _, _ = run_fake(
+                    args, FAKE_SPEC + ",broken=3", tmp_dir, **env
+                )
+                self.assertEqual(proc.returncode, 1, proc.stdout)
+                self.assertIn("2 failed", proc.stdout)
+                self.assertNotIn("Removing", proc.stdout)
+                self.assertEqual(get_files(f"{tmp_dir}/out/HPAP-001"), files)
+
+
+if __name__ == '__main__':
+    unittest.main()